@@ -0,0 +1,380 @@
+"""
+Benchmarks for calculate.py.
+
+Usage: python bench_calculate.py [BENCHMARK_NAME ...]
+
+Each benchmark prints one line per case: its name and best-of-N seconds.
+"""
+import math
+import os
+import subprocess
+import sys
+import timeit
+from unittest.mock import patch
+
+import calculate
+import numpy as np
+import pandas as pd
+from test_calculate import (
+    Column,
+    ImportTimeBudgetMicroseconds,
+    ImportTimeTest,
+    P,
+    Settings,
+    import_times,
+)
+
+N_ROWS = 1_000_000
+
+
+def _time(fn, *, number=3, repeat=5) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def _render(table, params, input_columns):
+    return calculate.render(
+        table, params, input_columns=input_columns, settings=Settings()
+    )
+
+
+def _currency_table(n_columns: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            f"c{i}": np.round(rng.uniform(-1e4, 1e4, N_ROWS), 2)
+            for i in range(n_columns)
+        }
+    )
+
+
+def bench_fixed_point():
+    """Exact mode should be within 2x of the float path."""
+    table = _currency_table(4)
+    input_columns = {c: Column(c, "number", "{:,.2f}") for c in table.columns}
+    for operation in ["add", "multiply"]:
+        for exact in [False, True]:
+            params = P(
+                operation=operation,
+                colnames=list(table.columns),
+                exact_fixed_point=exact,
+            )
+            if operation == "multiply":
+                params["colnames"] = params["colnames"][:2]
+            seconds = _time(lambda: _render(table.copy(), params, input_columns))
+            print(f"{operation} exact={exact}: {seconds:.4f}s")
+
+
+def bench_accurate_sum():
+    """Compensated summation should cost a small constant factor over a plain sum."""
+    rng = np.random.default_rng(0)
+    n_rows = 10_000
+    table = pd.DataFrame(
+        {
+            f"c{i}": rng.standard_normal(n_rows) * 10.0 ** rng.integers(-8, 8, n_rows)
+            for i in range(1000)
+        }
+    )
+    input_columns = {c: Column(c, "number", "{:,}") for c in table.columns}
+    exact = np.array([math.fsum(row) for row in table.to_numpy()])
+    for operation in ["add", "mean"]:
+        for accurate in [False, True]:
+            params = P(
+                operation=operation,
+                colnames=list(table.columns),
+                accurate_sum=accurate,
+                outcolname="X",
+            )
+            seconds = _time(lambda: _render(table.copy(), params, input_columns))
+            result = _render(table.copy(), params, input_columns)["dataframe"]["X"]
+            if operation == "add":
+                error = np.abs(result.to_numpy() - exact).max()
+            else:
+                error = np.abs(result.to_numpy() - exact / 1000).max()
+            print(
+                f"{operation} accurate={accurate}: {seconds:.4f}s, "
+                f"max error {error:g}"
+            )
+
+    table = pd.DataFrame(
+        {"A": rng.standard_normal(N_ROWS) * 10.0 ** rng.integers(-8, 8, N_ROWS)}
+    )
+    input_columns = {"A": Column("A", "number", "{:,}")}
+    for accurate in [False, True]:
+        params = P(operation="percent_of_column_sum", col1="A", accurate_sum=accurate)
+        seconds = _time(lambda: _render(table.copy(), params, input_columns))
+        print(f"percent_of_column_sum accurate={accurate}: {seconds:.4f}s")
+
+
+def bench_sparse():
+    """Find the density at which the sparse path stops paying off."""
+    rng = np.random.default_rng(0)
+
+    def sparse_column(density):
+        return np.where(
+            rng.random(N_ROWS) < density, rng.standard_normal(N_ROWS), np.nan
+        )
+
+    for density in [0.001, 0.01, 0.05, 0.1, 0.2, 0.5, 0.8]:
+        # add: 10 columns; their union has ~`density` of rows
+        add_table = pd.DataFrame(
+            {f"c{i}": sparse_column(density / 10) for i in range(10)}
+        )
+        # subtract: a sparse column and a dense one
+        subtract_table = pd.DataFrame(
+            {"c0": sparse_column(density), "c1": rng.standard_normal(N_ROWS)}
+        )
+        for operation, table, params in [
+            ("add", add_table, P(operation="add", colnames=list(add_table.columns))),
+            ("subtract", subtract_table, P(operation="subtract", col1="c0", col2="c1")),
+        ]:
+            input_columns = {c: Column(c, "number", "{:,}") for c in table.columns}
+            timings = []
+            for threshold in [-1, np.inf]:  # always dense, always sparse
+                with patch.object(
+                    calculate, "SparseDensityThreshold", threshold
+                ), patch.object(calculate, "BinarySparseDensityThreshold", threshold):
+                    timings.append(
+                        _time(lambda: _render(table.copy(), params, input_columns))
+                    )
+            print(
+                f"{operation} density={density}: dense {timings[0]:.4f}s, "
+                f"sparse {timings[1]:.4f}s"
+            )
+
+
+def bench_import_time():
+    """`import calculate` should take a few milliseconds; calculating pays the rest."""
+    for label, code in [
+        ("import", "import calculate"),
+        ("migrate_params", ImportTimeTest.Code),
+        (
+            "render",
+            "import calculate; calculate.pd.DataFrame; calculate.i18n.trans",
+        ),
+    ]:
+        times = min(
+            (import_times(code) for _ in range(5)), key=lambda t: t["calculate"]
+        )
+        deferred = sum(times.get(m, 0) for m in ["numpy", "pandas", "cjwmodule"])
+        print(
+            f"{label}: import calculate {times['calculate']}us "
+            f"(budget {ImportTimeBudgetMicroseconds}us), "
+            f"then numpy+pandas+cjwmodule {deferred}us"
+        )
+
+
+def bench_migrate_params():
+    """A fleet-wide upgrade runs migrate_params() once per stored params dict."""
+    from test_calculate_migrate import V0Params, V2Params, V8Params, V9Params
+
+    n_params = 100_000
+    for label, params in [
+        ("v0", V0Params),
+        ("v2", V2Params),
+        ("v8", V8Params),
+        ("v9", V9Params),
+    ]:
+        params_list = [dict(params) for _ in range(n_params)]
+        seconds = _time(
+            lambda: [calculate.migrate_params(p) for p in params_list],
+            number=1,
+            repeat=3,
+        )
+        print(f"{label} migrate_params: {n_params / seconds:,.0f} params/s")
+
+
+def bench_parse_text_numbers():
+    """Parsing text on the fly should beat converting cell by cell first."""
+    numbers = _currency_table(4)
+    text = numbers.apply(lambda column: column.map("${:,.2f}".format))
+    params = P(colnames=list(text.columns), parse_text_numbers=True)
+    number_columns = {c: Column(c, "number", "{:,.2f}") for c in text.columns}
+    text_columns = {c: Column(c, "text", None) for c in text.columns}
+
+    def convert_then_render():
+        converted = text.apply(
+            lambda column: [float(s.replace("$", "").replace(",", "")) for s in column]
+        )
+        return _render(converted, params, number_columns)
+
+    for label, fn in [
+        ("numbers", lambda: _render(numbers.copy(), params, number_columns)),
+        ("parse_text_numbers", lambda: _render(text.copy(), params, text_columns)),
+        ("convert cell by cell, then render", convert_then_render),
+    ]:
+        print(f"{label}: {_time(fn, number=1, repeat=3):.4f}s")
+
+
+def bench_timestamps():
+    """Timestamp arithmetic should cost about as much as number arithmetic."""
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame(
+        {
+            f"c{i}": pd.Series(rng.integers(0, 1 << 60, N_ROWS)).astype(
+                "datetime64[ns]"
+            )
+            for i in range(4)
+        }
+    )
+    input_columns = {c: Column(c, "timestamp", None) for c in table.columns}
+    numbers = _currency_table(4)
+    number_columns = {c: Column(c, "number", "{:,.2f}") for c in numbers.columns}
+
+    def per_row_python():
+        return [(a - b) / pd.Timedelta(days=1) for a, b in zip(table.c0, table.c1)]
+
+    for label, params in [
+        ("subtract", P(operation="subtract", col1="c0", col2="c1")),
+        ("mean", P(operation="mean", colnames=list(table.columns))),
+        ("maximum", P(operation="maximum", colnames=list(table.columns))),
+    ]:
+        seconds = _time(lambda: _render(table.copy(), params, input_columns))
+        number_seconds = _time(lambda: _render(numbers.copy(), params, number_columns))
+        print(f"{label}: {seconds:.4f}s (numbers: {number_seconds:.4f}s)")
+    print(f"subtract, per-row Python: {_time(per_row_python, number=1, repeat=1):.4f}s")
+
+
+def bench_lookup():
+    """A keyed lookup should beat joining a lookup table, and reuse its index."""
+    rng = np.random.default_rng(0)
+    n_keys = 1000  # a lookup table (say, one row per region) above the data
+    keys = np.array([f"key{i}" for i in range(n_keys)], dtype=object)
+    padding = N_ROWS - n_keys
+    table = pd.DataFrame(
+        {
+            "A": rng.uniform(-1, 1, N_ROWS),
+            "Name": pd.Series(np.append(keys, [None] * padding), dtype="str"),
+            "Value": np.append(rng.uniform(-1, 1, n_keys), [np.nan] * padding),
+            "Region": pd.Series(keys[rng.integers(0, n_keys, N_ROWS)], dtype="str"),
+        }
+    )
+    input_columns = {
+        "A": Column("A", "number", "{:,.2f}"),
+        "Name": Column("Name", "text", None),
+        "Value": Column("Value", "number", "{:,.2f}"),
+        "Region": Column("Region", "text", None),
+    }
+    lookup = P(
+        colnames=["A"],
+        single_value_selector="lookup",
+        single_value_col="Value",
+        single_value_key_col="Name",
+        single_value_key=f"key{n_keys - 1}",
+    )
+    row_lookup = {
+        **lookup,
+        "single_value_selector": "row_lookup",
+        "single_value_row_key_col": "Region",
+    }
+
+    def join_then_add():
+        joined = table.merge(
+            table[["Name", "Value"]][:n_keys].rename(columns={"Value": "Looked up"}),
+            how="left",
+            left_on="Region",
+            right_on="Name",
+            suffixes=("", " (lookup)"),
+        )
+        return joined["A"] + joined["Looked up"]
+
+    def uncached(params):
+        calculate._KeyIndexes.clear()
+        return _render(table.copy(), params, input_columns)
+
+    for label, fn in [
+        ("lookup, new index", lambda: uncached(lookup)),
+        ("lookup, cached index", lambda: _render(table.copy(), lookup, input_columns)),
+        ("row_lookup, new index", lambda: uncached(row_lookup)),
+        (
+            "row_lookup, cached index",
+            lambda: _render(table.copy(), row_lookup, input_columns),
+        ),
+        ("join, then add", join_then_add),
+    ]:
+        print(f"{label}: {_time(fn, number=1, repeat=3):.4f}s")
+
+
+OutputMemoryScript = """
+import sys
+import numpy as np, pandas as pd
+import calculate_worker
+from test_calculate import P
+
+def status(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) * 1024
+
+n_rows, n_columns, result_only = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+# One 2-D block, as the worker reads a table from Arrow
+table = pd.DataFrame(
+    np.random.default_rng(0).uniform(-1, 1, (n_columns, n_rows)).T,
+    columns=[f"c{i}" for i in range(n_columns)],
+    copy=False,
+)
+header = {
+    "method": "render",
+    "params": P(operation="add", colnames=["c0", "c1"]),
+    "input_columns": {c: {"type": "number", "format": "{:,}"} for c in table.columns},
+    "result_only": result_only == "result_only",
+}
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")  # reset VmHWM, the peak RSS
+before = status("VmRSS")
+response, response_table = calculate_worker.handle_request(header, table)
+rendered = status("VmHWM") - before
+with open("/dev/null", "wb") as f:
+    calculate_worker.write_message(f, response, response_table)
+print(rendered, status("VmHWM") - before)
+"""
+
+
+def bench_output_memory(n_rows: int = 5_000_000, n_columns: int = 500):
+    """
+    Appending a column shouldn't copy the table; result-only responses are small.
+
+    Prints peak RSS beyond the input table (Linux only) while the worker
+    renders, then while it also writes its response. The default table is
+    20GB of float64: pass smaller `n_rows` on smaller machines.
+    """
+    print(f"input: {n_rows * n_columns * 8 / 1e6:,.0f}MB")
+    for mode in ["whole_table", "result_only"]:
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                OutputMemoryScript,
+                str(n_rows),
+                str(n_columns),
+                mode,
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        )
+        rendered, responded = (int(n) for n in completed.stdout.split())
+        print(
+            f"{mode}: render +{rendered / 1e6:,.0f}MB, "
+            f"render and respond +{responded / 1e6:,.0f}MB"
+        )
+
+
+BENCHMARKS = {
+    "fixed_point": bench_fixed_point,
+    "accurate_sum": bench_accurate_sum,
+    "sparse": bench_sparse,
+    "import_time": bench_import_time,
+    "migrate_params": bench_migrate_params,
+    "parse_text_numbers": bench_parse_text_numbers,
+    "timestamps": bench_timestamps,
+    "lookup": bench_lookup,
+    "output_memory": bench_output_memory,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        print(f"# {name}")
+        BENCHMARKS[name]()
@@ -1,24 +1,832 @@
-from dataclasses import dataclass
-from inspect import signature
-from typing import Any, Callable, Dict, List, Optional
+from __future__ import annotations
 
-import numpy as np
-import pandas as pd
-from cjwmodule import i18n
-from cjwmodule.util.colnames import gen_unique_clean_colnames_and_warn
+import math
+import sys
+import warnings
+
+TYPE_CHECKING = False  # like typing.TYPE_CHECKING, without importing typing
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, List, Optional, Tuple
+
+    import numpy as np
+    import pandas as pd
+    from cjwmodule import i18n
+
+
+class _LazyModule:
+    """
+    Stand-in for a module we only need once we calculate something.
+
+    Importing pandas and numpy takes far longer than `migrate_params()` does.
+    On first attribute access, we import the real module and replace this
+    stand-in in our globals, so later calls cost nothing extra.
+    """
+
+    def __init__(self, global_name: str, module_name: str):
+        self._global_name = global_name
+        self._module_name = module_name
+
+    def __getattr__(self, name: str):
+        __import__(self._module_name)
+        module = sys.modules[self._module_name]
+        globals()[self._global_name] = module
+        return getattr(module, name)
+
+
+np = _LazyModule("np", "numpy")
+pd = _LazyModule("pd", "pandas")
+pa = _LazyModule("pa", "pyarrow")
+pc = _LazyModule("pc", "pyarrow.compute")
+i18n = _LazyModule("i18n", "cjwmodule.i18n")
+_colnames = _LazyModule("_colnames", "cjwmodule.util.colnames")
+
+FixedPointMaxScale = 15
+"""Most decimal places exact mode will handle before falling back to floats."""
+
+FixedPointMaxMagnitude = 2 ** 53
+"""Largest scaled int64 we can convert back to float64 without rounding."""
+
+_NUMBER_FORMAT_PRECISION_PATTERN = r"\{:[^}]*?(?:\.(\d+))?([dfF%])\}"
+
+
+def _number_format_scale(format: Optional[str]) -> Optional[int]:
+    """
+    Number of decimal places a column's number format displays, or None.
+
+    "{:,.2f}" => 2; "{:,.1%}" => 3 (percentages are stored as fractions);
+    "{:,}" => None (no fixed number of decimal places).
+    """
+    import re  # only when calculating: it's slow to import
+
+    match = re.search(_NUMBER_FORMAT_PRECISION_PATTERN, format or "")
+    if match is None:
+        return None
+    precision, type_ = match.groups()
+    if type_ == "d":
+        return 0
+    scale = 6 if precision is None else int(precision)  # Python's default is 6
+    if type_ == "%":
+        scale += 2
+    return scale
+
+
+def _float_scale(value: float) -> int:
+    """
+    Number of decimal places in the shortest repr of `value`.
+
+    _float_scale(1.05) => 2; _float_scale(100.0) => 0.
+    """
+    from decimal import Decimal  # only when calculating: it's slow to import
+
+    exponent = Decimal(repr(value)).as_tuple().exponent
+    if not isinstance(exponent, int):  # nan, inf
+        return 0
+    return max(0, -exponent)
+
+
+def _to_fixed_point(
+    table: pd.DataFrame, columns: List[Any], extra_scales: List[int] = []
+) -> Optional[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Round `columns` to a common number of decimal places, as scaled integers.
+
+    Return `(scale, scaled, isnull)`: `scaled` is a 2-D float64 array of
+    integral values (NaN where `isnull`) equal to `value * 10**scale`. Return
+    None if a column format has no fixed number of decimal places or the
+    common scale is too big to be exact.
+    """
+    scales = [_number_format_scale(column.format) for column in columns]
+    if None in scales:
+        return None
+    scale = max(scales + extra_scales)
+    if scale > FixedPointMaxScale:
+        return None
+
+    values = table[[column.name for column in columns]].to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    scaled = np.rint(values * 10.0 ** scale)
+    return scale, scaled, np.isnan(values)
+
+
+def _fixed_point_agg(
+    table: pd.DataFrame, columns: List[Any], agg: str, scalar: Optional[float]
+) -> Optional[pd.Series]:
+    """
+    Exactly sum or multiply `columns` (and `scalar`, if set) row by row.
+
+    Each value is rounded to the decimal places its column format displays,
+    then all arithmetic happens on int64. We convert back to float64 once, at
+    the end, so the result is the float closest to the exact decimal answer.
+
+    Return None if the inputs cannot be computed exactly: the caller should
+    fall back to float arithmetic.
+    """
+    extra_scales = [] if scalar is None else [_float_scale(scalar)]
+    fixed = _to_fixed_point(table, columns, extra_scales)
+    if fixed is None:
+        return None
+    scale, scaled, isnull = fixed
+    one = 10.0 ** scale  # 1, scaled
+    scalar_scaled = one if scalar is None else np.rint(scalar * one)
+
+    if agg == "sum":
+        filled = np.where(isnull, 0.0, scaled)  # pandas skips nulls
+        magnitude = np.abs(filled).sum(axis=1).max(initial=0.0) + abs(scalar_scaled)
+        if not magnitude < FixedPointMaxMagnitude:  # also catches NaN, inf
+            return None
+        result = filled.astype(np.int64).sum(axis=1)
+        if scalar is not None:
+            result += np.int64(scalar_scaled)
+        result_scale = scale
+    else:
+        filled = np.where(isnull, one, scaled)  # pandas skips nulls
+        n_factors = filled.shape[1] + (0 if scalar is None else 1)
+        result_scale = scale * n_factors
+        if result_scale > 22:  # 10**22 is the biggest exact power of 10
+            return None
+        # Integer products only grow (or hit 0), so bounding the final
+        # magnitude bounds every intermediate one. Leave a bit of slack for
+        # rounding in this float estimate.
+        magnitude = np.abs(filled).prod(axis=1).max(initial=0.0) * abs(scalar_scaled)
+        if not magnitude < FixedPointMaxMagnitude / 2:
+            return None
+        result = filled.astype(np.int64).prod(axis=1)
+        if scalar is not None:
+            result *= np.int64(scalar_scaled)
+
+    return pd.Series(result / 10.0 ** result_scale, index=table.index, copy=False)
+
+
+def _fixed_point_binary(
+    table: pd.DataFrame, col1: Any, col2: Any, fn: Callable
+) -> Optional[pd.Series]:
+    """
+    Exactly compute `fn(x, y)` on two columns, as scaled integers.
+
+    `fn` must keep the scale of its inputs (e.g., subtraction). Nulls
+    propagate. Return None if the inputs cannot be computed exactly.
+    """
+    fixed = _to_fixed_point(table, [col1, col2])
+    if fixed is None:
+        return None
+    scale, scaled, isnull = fixed
+    filled = np.where(isnull, 0.0, scaled)
+    magnitude = np.abs(filled).sum(axis=1).max(initial=0.0)
+    if not magnitude < FixedPointMaxMagnitude:
+        return None
+    ints = filled.astype(np.int64)
+    result = fn(ints[:, 0], ints[:, 1]) / 10.0 ** scale
+    result[isnull.any(axis=1)] = np.nan
+    return pd.Series(result, index=table.index, copy=False)
+
+
+CompensatedSumLanes = 64
+"""Number of chunks to sum in parallel when summing down a single column."""
+
+
+def _neumaier_sums(
+    arrays: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Neumaier-sum equal-length float64 arrays, element by element.
+
+    Nulls (NaN) count as 0. Return `(totals, compensations, counts)`: the
+    accurate sum is `totals + compensations`, and `counts` is the number of
+    non-null values summed into each element.
+
+    Each step is vectorized down the whole array, so this costs a handful of
+    passes per input array -- no per-element Python.
+    """
+    total = np.zeros_like(arrays[0], dtype=np.float64)
+    compensation = np.zeros_like(total)
+    counts = np.zeros(total.shape, dtype=np.int64)
+    for array in arrays:
+        isnull = np.isnan(array)
+        counts += ~isnull
+        value = np.where(isnull, 0.0, array)
+        with np.errstate(invalid="ignore"):  # inf - inf
+            new_total = total + value
+            compensation += np.where(
+                np.abs(total) >= np.abs(value),
+                (total - new_total) + value,
+                (value - new_total) + total,
+            )
+        total = new_total
+    return total, compensation, counts
+
+
+def _compensated_sums(arrays: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Accurately sum equal-length float64 arrays, element by element.
+
+    Nulls (NaN) count as 0. Return `(sums, counts)`.
+    """
+    total, compensation, counts = _neumaier_sums(arrays)
+    # inf - inf makes NaN compensation. Trust the naive sum when it isn't finite.
+    return np.where(np.isfinite(total), total + compensation, total), counts
+
+
+def _compensated_row_sum(arrays: List[np.ndarray]) -> np.ndarray:
+    """Like `DataFrame.agg("sum", axis=1)`, but accurate."""
+    return _compensated_sums(arrays)[0]
+
+
+def _compensated_row_mean(arrays: List[np.ndarray]) -> np.ndarray:
+    """Like `DataFrame.agg("mean", axis=1)`, but accurate."""
+    sums, counts = _compensated_sums(arrays)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts == 0, np.nan, sums / counts)
+
+
+def _compensated_sum(series: pd.Series) -> float:
+    """
+    Like `Series.sum()`, but accurate.
+
+    We split the column into `CompensatedSumLanes` contiguous chunks and
+    Neumaier-sum them element by element (vectorized). That leaves a
+    chunk's worth of partial sums (plus their compensations), which
+    `math.fsum()` adds exactly.
+    """
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    n_lanes = CompensatedSumLanes
+    padded = np.zeros(-(-len(values) // n_lanes) * n_lanes, dtype=np.float64)
+    padded[: len(values)] = values
+    totals, compensations, _ = _neumaier_sums(list(padded.reshape(n_lanes, -1)))
+    if not np.isfinite(totals).all():
+        return float(np.nansum(values))  # inf or -inf; fsum can't add both
+    return math.fsum(np.concatenate([totals, compensations]))
+
+
+def _validity_masks(table: pd.DataFrame, colnames: List[str]) -> List[np.ndarray]:
+    """
+    Find each column's non-null values, once.
+
+    Return one boolean array per column: True where the value is not null.
+    Null policies combine these with bitwise ops instead of re-scanning data.
+    """
+    return [table[colname].notna().to_numpy() for colname in colnames]
+
+
+def _zero_filled_columns(
+    table: pd.DataFrame, colnames: List[str], masks: List[np.ndarray]
+) -> pd.DataFrame:
+    """
+    Return `table[colnames]`, with nulls replaced by 0.
+
+    Columns without nulls are passed through as-is.
+    """
+    return pd.DataFrame(
+        {
+            colname: table[colname] if mask.all() else table[colname].where(mask, 0)
+            for colname, mask in zip(colnames, masks)
+        },
+        index=table.index,
+    )
+
+
+def _null_policy_result_mask(
+    masks: List[np.ndarray], params: Dict[str, Any]
+) -> Optional[np.ndarray]:
+    """
+    Find the output rows the user's null policy allows to be non-null.
+
+    Return None if the policy allows every row.
+    """
+    if params["null_policy"] == "propagate":
+        return np.logical_and.reduce(masks)
+    elif params["null_policy"] == "min_count":
+        counts = np.zeros(len(masks[0]), dtype=np.int64)
+        for mask in masks:
+            counts += mask
+        return _null_policy_count_mask(counts, len(masks), params)
+    else:
+        return None
+
+
+def _null_policy_count_mask(
+    counts: np.ndarray, n_columns: int, params: Dict[str, Any]
+) -> Optional[np.ndarray]:
+    """
+    Like `_null_policy_result_mask()`, from each row's count of non-nulls.
+    """
+    if params["null_policy"] == "propagate":
+        return counts == n_columns
+    elif params["null_policy"] == "min_count":
+        return counts >= params["null_min_count"]
+    else:
+        return None
+
+
+SparseDensityThreshold = 0.5
+"""Aggregate only rows with values when at most this fraction of rows has any.
+
+`DataFrame.agg(..., axis=1)` is slow per row, so skipping empty rows pays off
+even on fairly dense tables. (See `python bench_calculate.py sparse`.)"""
+
+BinarySparseDensityThreshold = 0.0
+"""Like SparseDensityThreshold, for two-column arithmetic.
+
+Elementwise arithmetic costs about as much as gathering and scattering rows,
+so by default BinaryOp doesn't even count nulls."""
+
+
+def _sparse_row_positions(
+    masks: List[np.ndarray], *, need_all: bool, threshold: float
+) -> Optional[np.ndarray]:
+    """
+    Find the rows worth computing, if there are few enough of them.
+
+    With `need_all`, a row is worth computing only if all its inputs are
+    non-null (as in arithmetic). Otherwise, it is worth computing if any input
+    is non-null (as in aggregations that skip nulls).
+
+    Return None if more than `threshold` of rows may be worth computing: then
+    it's cheaper to compute every row than to gather and scatter.
+    """
+    n_rows = len(masks[0])
+    counts = [np.count_nonzero(mask) for mask in masks]
+    # Upper bound on the number of rows worth computing
+    n_candidates = min(counts) if need_all else sum(counts)
+    if n_rows == 0 or n_candidates > n_rows * threshold:
+        return None
+    if need_all:
+        return np.flatnonzero(np.logical_and.reduce(masks))
+    else:
+        return np.flatnonzero(np.logical_or.reduce(masks))
+
+
+def _compute_sparse(
+    table: pd.DataFrame,
+    colnames: List[str],
+    positions: np.ndarray,
+    compute: Callable[[pd.DataFrame], pd.Series],
+    fill_value: float,
+) -> pd.Series:
+    """
+    Run `compute()` on just the rows at `positions`; `fill_value` elsewhere.
+    """
+    unique_colnames = list(dict.fromkeys(colnames))
+    computed = compute(table[unique_colnames].take(positions))
+    result = np.full(len(table), fill_value, dtype=np.float64)
+    result[positions] = computed.to_numpy(dtype=np.float64, na_value=np.nan)
+    return pd.Series(result, index=table.index, copy=False)
+
+
+MemoryBudget = 1 << 30
+"""Bytes `render()` may allocate on top of its input table.
+
+When computing all rows at once would need more, `render()` streams one
+column at a time or computes rows in chunks. (See `plan_execution()`.)"""
+
+MinChunkRows = 1024
+"""Fewest rows to compute at a time, however small MemoryBudget is."""
+
+StreamingAggs = {"sum", "product", "min", "max", "mean"}
+"""DataFrame.agg() functions `_streaming_agg()` can compute column by column."""
+
+
+class ExecutionPlan:
+    """
+    How `render()` will compute its output, and how much memory that takes.
+    """
+
+    def __init__(
+        self,
+        strategy: str,
+        estimated_bytes: int,
+        budget: int,
+        estimates: Dict[str, int],
+        chunk_rows: Optional[int] = None,
+    ):
+        self.strategy = strategy
+        """"whole_table", "column_streaming" or "row_chunked"."""
+
+        self.estimated_bytes = estimated_bytes
+        """Estimated peak bytes `render()` will allocate, using `strategy`."""
+
+        self.budget = budget
+        """MemoryBudget, when we planned."""
+
+        self.estimates = estimates
+        """Estimated peak bytes of each strategy the operation supports."""
+
+        self.chunk_rows = chunk_rows
+        """Rows to compute at a time, if `strategy` is "row_chunked"."""
+
+    def __repr__(self):
+        return "ExecutionPlan(%r, estimated_bytes=%d, budget=%d, chunk_rows=%r)" % (
+            self.strategy,
+            self.estimated_bytes,
+            self.budget,
+            self.chunk_rows,
+        )
+
+
+def _streaming_agg(
+    table: pd.DataFrame,
+    colnames: List[str],
+    agg: str,
+    val: Optional[float],
+    null_as_zero: bool,
+) -> Tuple[pd.Series, np.ndarray]:
+    """
+    Like `table[colnames].agg(agg, axis=1)`, reading one column at a time.
+
+    `DataFrame.agg(..., axis=1)` copies every column into one 2-D array, then
+    allocates temporaries the same size. Here, memory use doesn't grow with
+    the number of columns. Nulls are skipped, or count as 0 if `null_as_zero`.
+
+    Like `DataFrame.agg()`, we sum and multiply integer columns as int64.
+
+    Return `(series, counts)`: `counts` is each row's number of values that
+    weren't skipped.
+    """
+    if agg != "mean" and all(table[c].dtype.kind in "iu" for c in colnames):
+        dtype = np.int64  # no nulls; overflow wraps, as in DataFrame.agg()
+    else:
+        dtype = np.float64
+    if agg == "product":
+        result = np.ones(len(table), dtype=dtype)
+    elif agg in {"min", "max"}:
+        # np.array() copies: to_numpy() may return a view of the input
+        result = np.array(table[colnames[0]].to_numpy(dtype=dtype, na_value=np.nan))
+    else:
+        result = np.zeros(len(table), dtype=dtype)
+    counts = np.zeros(len(table), dtype=np.int64)
+
+    with np.errstate(invalid="ignore", over="ignore"):  # inf - inf, overflow
+        for colname in colnames:
+            values = table[colname].to_numpy(dtype=dtype, na_value=np.nan)
+            if dtype is np.float64:
+                isnull = np.isnan(values)
+                if null_as_zero:
+                    counts += 1
+                    values = np.where(isnull, 0.0, values)
+                else:
+                    counts += ~isnull
+                    if agg in {"sum", "mean"}:
+                        values = np.where(isnull, 0.0, values)
+                    elif agg == "product":
+                        values = np.where(isnull, 1.0, values)
+            else:
+                counts += 1  # integer columns have no nulls
+            if agg in {"sum", "mean"}:
+                result += values
+            elif agg == "product":
+                result *= values
+            elif agg == "min":
+                np.fmin(result, values, out=result)  # fmin() skips NaN
+            else:
+                np.fmax(result, values, out=result)
+
+        if agg == "mean":
+            result = np.where(counts == 0, np.nan, result / np.maximum(counts, 1))
+        elif val is not None:
+            result = result + val if agg == "sum" else result * val
+    return pd.Series(result, index=table.index, copy=False), counts
+
+
+def _compute_in_chunks(
+    table: pd.DataFrame,
+    chunk_rows: int,
+    compute: Callable[[pd.DataFrame, slice], pd.Series],
+) -> pd.Series:
+    """
+    Run `compute(subtable, rows)` on `chunk_rows` rows at a time.
+
+    `rows` is the slice of `table` that `subtable` holds, so `compute()` can
+    slice other per-row arrays to match. Peak memory is the output, plus one
+    chunk's worth of `compute()`'s temporaries.
+    """
+    if len(table) <= chunk_rows:
+        return compute(table, slice(None))
+
+    result = None
+    for start in range(0, len(table), chunk_rows):
+        stop = start + chunk_rows
+        values = compute(table.iloc[start:stop], slice(start, stop)).to_numpy()
+        if result is None:
+            result = np.empty(len(table), dtype=values.dtype)
+        elif values.dtype != result.dtype:
+            result = result.astype(np.result_type(result, values))
+        result[start:stop] = values
+    return pd.Series(result, index=table.index, copy=False)
+
+
+def _compute_with_null_policy(
+    table: pd.DataFrame,
+    colnames: List[str],
+    params: Dict[str, Any],
+    compute: Callable[[pd.DataFrame, List[np.ndarray]], pd.Series],
+) -> pd.Series:
+    """
+    Run `compute(table, masks)`, then null the rows the null policy rejects.
+    """
+    masks = _validity_masks(table, colnames)
+    series = compute(table, masks)
+    result_mask = _null_policy_result_mask(masks, params)
+    return series if result_mask is None else series.where(result_mask)
+
+
+NumberTextPattern = (
+    r"^\s*(?:[-+]?\s*[$€£¥₹]?|[$€£¥₹]\s*[-+]?)\s*"
+    r"(?:\d{1,3}(?:,\d{3})+(?:\.\d*)?|\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?\s*%?\s*$"
+)
+"""Text `_parse_text_numbers()` understands: "1,234.5", "-$6", "7%", "8e3"."""
+
+NumberTextNoisePattern = r"[\s,+$€£¥₹%]"
+"""Characters to remove from NumberTextPattern matches before parsing floats."""
+
+
+ParseChunkRows = 65536
+"""Rows `_parse_text_numbers()` parses at a time: that bounds its temporaries."""
+
+
+def _parse_text_numbers(
+    series: pd.Series, out: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, int, bool]:
+    """
+    Parse text like "1,234.5", "-$6" or "7%" (=> 0.07) as float64.
+
+    Return `(values, n_invalid, all_percent)`; `values` is `out`, if given.
+    Null and blank cells become
+    NaN, and so do the `n_invalid` other cells that don't match
+    NumberTextPattern. `all_percent` means every number ended with "%".
+
+    All the work happens in Arrow compute kernels, ParseChunkRows at a time:
+    there is no Python loop over cells, and only `values` spans every row.
+    """
+    values = np.empty(len(series), dtype=np.float64) if out is None else out
+    n_invalid = n_numbers = n_percent = 0
+    for start in range(0, len(series), ParseChunkRows):
+        stop = start + ParseChunkRows
+        text = pa.array(
+            series.array[start:stop], type=pa.large_string(), from_pandas=True
+        )
+        is_number = pc.match_substring_regex(text, NumberTextPattern)
+        numbers = pc.replace_substring_regex(
+            pc.if_else(is_number, text, None), NumberTextNoisePattern, ""
+        )
+        chunk = pc.cast(numbers, pa.float64()).to_numpy(zero_copy_only=False)
+        is_percent = pc.and_(
+            is_number, pc.ends_with(pc.utf8_rtrim_whitespace(text), "%")
+        )
+        values[start:stop] = np.where(
+            pc.fill_null(is_percent, False).to_numpy(zero_copy_only=False),
+            chunk / 100,
+            chunk,
+        )
+
+        n_chunk_numbers = pc.sum(is_number, min_count=0).as_py()
+        n_blank = pc.sum(
+            pc.equal(pc.utf8_trim_whitespace(text), ""), min_count=0
+        ).as_py()
+        n_invalid += len(text) - text.null_count - n_blank - n_chunk_numbers
+        n_numbers += n_chunk_numbers
+        n_percent += pc.sum(is_percent, min_count=0).as_py()
+    return values, n_invalid, n_numbers > 0 and n_percent == n_numbers
+
+
+def _is_text(series: pd.Series) -> bool:
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def _parse_text_memory(table: pd.DataFrame, colnames: List[str]) -> Tuple[float, int]:
+    """
+    Estimate bytes `_parse_text_inputs()` allocates to parse text `colnames`.
+
+    Return `(per_row, per_table)`: the float64 columns it returns, which
+    every strategy computes from; and the temporaries of parsing one chunk
+    of one column -- about two copies of its text and three float64 arrays.
+    """
+    n_rows = len(table)
+    if not colnames or not n_rows:
+        return 0, 0
+    text_bytes = max(table[c].nbytes for c in colnames) / n_rows
+    return 8 * len(colnames), int((2 * text_bytes + 24) * min(n_rows, ParseChunkRows))
+
+
+def _parse_text_inputs(
+    table: pd.DataFrame, colnames: List[str], input_columns: Dict[str, Any]
+) -> Tuple[pd.DataFrame, Dict[str, Any], List[i18n.I18nMessage]]:
+    """
+    Return `(table, input_columns, parse_warnings)`, with text `colnames` parsed.
+
+    Each column is parsed once, however many params name it, and the result
+    is shared by every chunk and strategy. The returned table shares its
+    other columns with `table`; `table` itself is untouched.
+
+    The parsed columns share one float64 block, as if the table had held
+    numbers all along: else `DataFrame.agg()` would copy them into one.
+    """
+    colnames = list(dict.fromkeys(colnames))
+    block = np.empty((len(colnames), len(table)), dtype=np.float64)
+    input_columns = dict(input_columns)
+    parse_warnings = []
+    for colname, out in zip(colnames, block):
+        _, n_invalid, all_percent = _parse_text_numbers(table[colname], out=out)
+        input_columns[colname] = input_columns[colname]._replace(
+            type="number", format=PercentFormat if all_percent else "{:,}"
+        )
+        if n_invalid:
+            parse_warnings.append(
+                i18n.trans(
+                    "badData.parse_text_numbers.invalid",
+                    "Nulled {n, plural, one {# cell} other {# cells}} in “{column}”: not a number",
+                    {"n": n_invalid, "column": colname},
+                )
+            )
+    parsed = pd.DataFrame(block.T, index=table.index, columns=colnames, copy=False)
+    data = pd.concat([table.drop(columns=colnames), parsed], axis=1)
+    return data, input_columns, parse_warnings
+
+
+TimestampAggs = {"mean", "min", "max"}
+"""DataFrame.agg() functions `_timestamp_agg()` computes: timestamps in and out."""
+
+DurationUnitSeconds = {
+    "seconds": 1,
+    "minutes": 60,
+    "hours": 3600,
+    "days": 86400,
+    "weeks": 604800,
+}
+"""duration_unit param value => seconds per unit."""
+
+_NaT = -(1 << 63)
+"""NaT, as int64 ticks."""
+
+
+def _is_timestamp(series: pd.Series) -> bool:
+    return series.dtype.kind == "M"
+
+
+def _timestamp_ticks(columns: List[pd.Series]) -> Tuple[List[np.ndarray], str]:
+    """
+    Return each timestamp column as int64 ticks, and the unit of a tick.
+
+    Ticks are the finest unit among `columns`: nanoseconds, for Workbench's
+    timestamps. NaT is `_NaT`. Timezone-aware columns are converted to UTC.
+    """
+    dtype = np.result_type(*(np.dtype(f"datetime64[{c.dt.unit}]") for c in columns))
+    arrays = [column.to_numpy(dtype=dtype).view(np.int64) for column in columns]
+    return arrays, np.datetime_data(dtype)[0]
+
+
+def _timestamp_difference(x: pd.Series, y: pd.Series, unit: str) -> pd.Series:
+    """
+    Return `x - y` in `unit`s (see DurationUnitSeconds), as float64.
+
+    We subtract int64 ticks, so the difference is exact before division;
+    only differences too big for int64 (over 292 years, in nanoseconds) are
+    computed in float64 instead. Null if `x` or `y` is null.
+    """
+    (x_ticks, y_ticks), tick_unit = _timestamp_ticks([x, y])
+    ticks_per_unit = DurationUnitSeconds[unit] * (
+        np.timedelta64(1, "s") // np.timedelta64(1, tick_unit)
+    )
+    diff = x_ticks - y_ticks  # wraps on overflow
+    overflow = ((x_ticks ^ y_ticks) & (x_ticks ^ diff)) < 0
+    result = diff / ticks_per_unit
+    if overflow.any():
+        result[overflow] = (
+            x_ticks[overflow].astype(np.float64) - y_ticks[overflow]
+        ) / ticks_per_unit
+    result[(x_ticks == _NaT) | (y_ticks == _NaT)] = np.nan
+    return pd.Series(result, index=x.index, copy=False)
+
+
+def _timestamp_agg(table: pd.DataFrame, colnames: List[str], agg: str) -> pd.Series:
+    """
+    Aggregate timestamp columns row by row into a timestamp, skipping nulls.
+
+    `agg` is "min", "max" or "mean" (rounded to the nearest tick). The mean
+    adds int64 offsets from each row's minimum, so it's exact, except in rows
+    where that sum could overflow int64: there, we add float64 offsets.
+    """
+    arrays, tick_unit = _timestamp_ticks([table[colname] for colname in colnames])
+    ticks = np.column_stack(arrays)
+    valid = ticks != _NaT
+    n_valid = valid.sum(axis=1)
+
+    if agg == "max":
+        result = ticks.max(axis=1)  # NaT is the smallest int64
+    else:
+        result = np.where(valid, ticks, np.iinfo(np.int64).max).min(axis=1)
+        if agg == "mean":
+            # Offsets are >= 0, but may not fit in int64: wrap, then view as uint64
+            offsets = np.where(valid, ticks - result[:, None], 0).view(np.uint64)
+            divisor = np.maximum(n_valid, 1)
+            sums = offsets.view(np.int64).sum(axis=1)
+            quotient, remainder = np.divmod(sums, divisor)
+            mean = result + quotient + (2 * remainder >= divisor)  # round half up
+            # Where the int64 sum may have overflowed, add float64 offsets
+            big = offsets.max(axis=1) >= np.iinfo(np.int64).max // len(colnames)
+            if big.any():
+                mean_offsets = offsets[big].sum(axis=1, dtype=np.float64) / divisor[big]
+                mean[big] = result[big] + np.rint(mean_offsets).astype(np.int64)
+            result = mean
+    result[n_valid == 0] = _NaT
+
+    return pd.Series(
+        result.view(f"datetime64[{tick_unit}]"), index=table.index, copy=False
+    )
+
+
+class _KeyIndex:
+    """
+    Hash index on a key column: key => position of the first row with it.
+
+    Null keys match nothing.
+    """
+
+    def __init__(self, series: pd.Series):
+        is_first = series.notna().to_numpy() & ~series.duplicated().to_numpy()
+        self.positions = np.flatnonzero(is_first)
+        """Row of each key in `keys`."""
+
+        self.keys = pd.Index(series.iloc[self.positions])
+        """Unique keys. Its hash table is built on first lookup, then kept."""
+
+        self.arrow_keys = None
+        """Unique keys, as the value set for `pc.index_in()`; built on first use."""
+
+    def get_position(self, key: str) -> int:
+        """Return the key's row, or -1 if it isn't in the index: one hash probe."""
+        [found] = self.keys.get_indexer([key])
+        return -1 if found < 0 else int(self.positions[found])
+
+    def get_positions(self, keys: pd.Series) -> np.ndarray:
+        """
+        Return each key's row, or -1 if it isn't in the index.
+
+        Arrow probes Arrow strings many times faster than pandas can (pandas
+        converts them to Python strings first), even counting the hash table
+        on the unique keys it builds per call.
+        """
+        if self.arrow_keys is None:
+            self.arrow_keys = pa.array(
+                self.keys.array, type=pa.large_string(), from_pandas=True
+            )
+        probe = pa.array(keys.array, type=pa.large_string(), from_pandas=True)
+        found = pc.fill_null(pc.index_in(probe, value_set=self.arrow_keys), -1)
+        found = found.to_numpy()
+        hit = found >= 0
+        positions = np.full(len(found), -1, dtype=np.intp)
+        positions[hit] = self.positions[found[hit]]
+        return positions
+
+
+_KeyIndexes = {}
+"""id(Arrow array) => _KeyIndex. See `_key_index()`."""
+
+
+def _key_index(series: pd.Series) -> _KeyIndex:
+    """
+    Return a hash index on `series`, cached per column version.
+
+    An Arrow-backed column's data is immutable: editing the column replaces
+    it. So each Arrow array is a version, and we cache its index for as long
+    as it lives. NumPy-backed columns can change in place; we don't cache.
+    """
+    try:
+        data = series.array.__arrow_array__()
+    except AttributeError:
+        return _KeyIndex(series)
+
+    index = _KeyIndexes.get(id(data))
+    if index is None:
+        import weakref  # only when calculating: it's slow to import
+
+        index = _KeyIndexes[id(data)] = _KeyIndex(series)
+        weakref.finalize(data, _KeyIndexes.pop, id(data), None)
+    return index
 
 
-@dataclass
 class MulticolumnOp:
     """
     Multiple-column operations (add, average, ...).
     """
 
-    agg: str
-    """Argument to pass to pd.DataFrame.agg()."""
+    def __init__(
+        self,
+        agg: str,
+        default_result_column_format: str,
+        accurate_agg: Optional[Callable[[List[np.ndarray]], np.ndarray]] = None,
+    ):
+        self.agg = agg
+        """Argument to pass to pd.DataFrame.agg()."""
+
+        self.default_result_column_format = default_result_column_format
+        """op.default_result_column_format.format('x, y') => 'Sum of x, y'."""
 
-    default_result_column_format: str
-    """op.default_result_column_format.format('x, y') => 'Sum of x, y'."""
+        self.accurate_agg = accurate_agg
+        """Function to aggregate float64 columns with compensated summation, when
+        the user asks for an accurate sum."""
+
+        self.accepts_timestamps = agg in TimestampAggs
+        """True if timestamp columns aggregate to a timestamp."""
 
     def default_result_column_name(self, colnames: List[str]) -> str:
         """op.default_result_column_name(['x', 'y']) => 'Sum of x, y'."""
@@ -29,11 +837,110 @@ class MulticolumnOp:
 
         return self.default_result_column_format.format(cols=colnames_str)
 
+    def _has_single_value(self, params) -> bool:
+        """True if the user adds/multiplies all rows by a cell or constant."""
+        return (
+            self.agg in {"sum", "product"} and params["single_value_selector"] != "none"
+        )
+
+    def input_colnames(self, params) -> List[str]:
+        """
+        Columns `render()` reads numbers from (not counting a single value).
+
+        Empty if `render()` is waiting for parameters.
+        """
+        colnames = params["colnames"]
+        if len(colnames) == 1 and not self._has_single_value(params):
+            return []
+        elif (
+            self._has_single_value(params)
+            and params["single_value_selector"] == "row_lookup"
+            and params["single_value_col"]
+        ):
+            return colnames + [params["single_value_col"]]  # a value per row
+        return colnames
+
+    def _find_key_row(self, table, params):
+        """
+        Find the row where the key column holds the key the user specified.
+        """
+        key_col = params["single_value_key_col"]
+        if not key_col:
+            return i18n.trans(
+                "badParam.single_value_key_col.missing",
+                "Please select the column to look up",
+            )
+        row = _key_index(table[key_col]).get_position(params["single_value_key"])
+        if row < 0:
+            return i18n.trans(
+                "badParam.single_value_key.notFound",
+                "“{key}” is not in column “{column}”",
+                {"key": params["single_value_key"], "column": key_col},
+            )
+        return row
+
+    def _check_key_columns(self, params, input_columns):
+        """
+        Return an error if a column we look keys up in isn't text, else None.
+        """
+        key_params = {
+            "lookup": ["single_value_key_col"],
+            "row_lookup": ["single_value_key_col", "single_value_row_key_col"],
+        }.get(params["single_value_selector"], [])
+        for key_param in key_params:
+            colname = params[key_param]
+            if colname in input_columns and input_columns[colname].type != "text":
+                return i18n.trans(
+                    "badParam.single_value_key_col.notText",
+                    "“{column}” is not text. Please choose a text column of keys.",
+                    {"column": colname},
+                )
+        return None
+
+    def _get_row_lookup_values(self, table, params):
+        """
+        Find each row's value the user specified: a gather through a key index.
+
+        Rows whose key isn't in the key column get NaN.
+        """
+        col = params["single_value_col"]
+        key_col = params["single_value_key_col"]
+        row_key_col = params["single_value_row_key_col"]
+        if not col:
+            return i18n.trans(
+                "badParam.single_value_col.missing",
+                "Please select the cell value's column",
+            )
+        elif not key_col:
+            return i18n.trans(
+                "badParam.single_value_key_col.missing",
+                "Please select the column to look up",
+            )
+        elif not row_key_col:
+            return i18n.trans(
+                "badParam.single_value_row_key_col.missing",
+                "Please select the column with each row's key",
+            )
+        positions = _key_index(table[key_col]).get_positions(table[row_key_col])
+        values = table[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        return np.where(positions >= 0, values[positions], np.nan)
+
     def _get_single_value(self, table, params):
         """
         Find the single value the user specified (cell value or constant).
         """
-        if params["single_value_selector"] == "cell":  # 'Cell value'
+        if params["single_value_selector"] == "lookup":  # 'Cell value where ...'
+            col = params["single_value_col"]
+            if not col:
+                return i18n.trans(
+                    "badParam.single_value_col.missing",
+                    "Please select the cell value's column",
+                )
+            row = self._find_key_row(table, params)
+            if isinstance(row, i18n.I18nMessage):
+                return row
+            return self._cell_number(table[col].iloc[row], params)
+        elif params["single_value_selector"] == "cell":  # 'Cell value'
             col = params["single_value_col"]
             # go from 1-based in the UI to 0 based in the table
             row = params["single_value_row"] - 1
@@ -53,85 +960,372 @@ class MulticolumnOp:
                     "badParam.single_value_col.missing",
                     "Please select the cell value's column",
                 )
-            value = table[col][row]
-            _error_not_a_number = i18n.trans(
-                "badParam.single_value_col.notANumber",
-                "The chosen cell does not contain a number",
-            )
-            if pd.isnull(value):
-                return _error_not_a_number
-            try:
-                return float(value)
-            except ValueError:
-                return _error_not_a_number
+            return self._cell_number(table[col][row], params)
         else:
             return params["single_value_constant"]
 
-    def render(self, table, params, input_columns) -> Dict[str, Any]:
+    def _cell_number(self, value, params):
+        """
+        Convert the cell value the user chose to a float (or error message).
+        """
+        if params["parse_text_numbers"] and isinstance(value, str):
+            [value], _, _ = _parse_text_numbers(pd.Series([value]))
+        _error_not_a_number = i18n.trans(
+            "badParam.single_value_col.notANumber",
+            "The chosen cell does not contain a number",
+        )
+        if pd.isnull(value):
+            return _error_not_a_number
+        try:
+            return float(value)
+        except ValueError:
+            return _error_not_a_number
+
+    def _agg(self, table, colnames, columns, val, params) -> pd.Series:
+        """
+        Aggregate each row of `table[colnames]`, then add/multiply `val`
+        (a scalar, or an array with a value per row).
+
+        Nulls are skipped.
+        """
+        if _is_timestamp(table[colnames[0]]):
+            return _timestamp_agg(table, colnames, self.agg)
+
+        series = None
+        if (
+            params["exact_fixed_point"]
+            and self.agg in {"sum", "product"}
+            and not isinstance(val, np.ndarray)  # looked up per row
+        ):
+            series = _fixed_point_agg(table, columns, self.agg, val)
+
+        if (
+            series is None
+            and params["accurate_sum"]
+            and self.accurate_agg
+            # DataFrame.agg() sums integers as int64: exactly, unlike floats
+            and not (
+                self.agg != "mean"
+                and all(table[c].dtype.kind in "iu" for c in colnames)
+            )
+        ):
+            arrays = [
+                table[colname].to_numpy(dtype=np.float64, na_value=np.nan)
+                for colname in colnames
+            ]
+            if val is not None and not isinstance(val, np.ndarray):
+                arrays.append(np.full(len(table), val, dtype=np.float64))
+            series = pd.Series(self.accurate_agg(arrays), index=table.index, copy=False)
+            if isinstance(val, np.ndarray):
+                # Outside the sum, which counts NaN as 0: a key that isn't
+                # found must give null, as it does on every other path
+                series += val
+
+        if series is None:
+            series = table[colnames].agg(self.agg, axis=1)
+            if val is not None:
+                if self.agg == "sum":
+                    series += val
+                else:
+                    series *= val
+
+        return series
+
+    def memory_per_row(
+        self, table, params
+    ) -> Tuple[float, Optional[float], Optional[float]]:
+        """
+        Estimate peak bytes per row `render()` allocates.
+
+        Return `(whole_table, column_streaming, row_chunked_overhead)`:
+        computing all rows at once; streaming columns (None if unsupported);
+        and the part of a row-chunked computation that isn't chunked.
+
+        Estimates are in float64 columns. They come from measuring
+        `DataFrame.agg()` and our own helpers with tracemalloc.
+        """
+        n_columns = len(params["colnames"])
+        timestamps = n_columns > 0 and _is_timestamp(table[params["colnames"][0]])
+        exact = params["exact_fixed_point"] and self.agg in {"sum", "product"}
+        accurate = params["accurate_sum"] and self.accurate_agg is not None
+        if timestamps and self.agg == "mean":
+            whole_table = 2.75 * n_columns + 7  # ticks, where() and offsets
+        elif timestamps:
+            whole_table = 2.25 * n_columns + 2.5  # ticks and where()
+        elif self.agg == "median":
+            whole_table = 4.75 * n_columns + 6  # np.nanmedian() partitions copies
+        elif exact:
+            whole_table = 3.25 * n_columns + 1
+        elif accurate:
+            whole_table = 0.25 * n_columns + 8.5
+        else:
+            whole_table = 1.75 * n_columns + 2
+        if params["null_policy"] == "zero":
+            whole_table += n_columns
+
+        if self.agg in StreamingAggs and not (exact or accurate or timestamps):
+            column_streaming = 6  # result, counts, null policy and temporaries
+        else:
+            column_streaming = None
+
+        row_chunked_overhead = 1.25  # output; masks are per chunk
+
+        if (
+            self._has_single_value(params)
+            and params["single_value_selector"] == "row_lookup"
+        ):
+            # Values, positions and the key index, for all rows at once
+            whole_table += 3
+            if column_streaming is not None:
+                column_streaming += 3
+            row_chunked_overhead += 3
+
+        return (
+            whole_table * 8,
+            None if column_streaming is None else column_streaming * 8,
+            row_chunked_overhead * 8,
+        )
+
+    def render(self, table, params, input_columns, plan) -> Dict[str, Any]:
         colnames = params["colnames"]
         if not colnames:
             return None, None  # waiting for parameter, do nothing
 
         columns = [input_columns[c] for c in colnames]
-        extra_scalar = (
-            self.agg in {"sum", "product"} and params["single_value_selector"] != "none"
-        )
+        extra_scalar = self._has_single_value(params)
         if len(columns) == 1 and not extra_scalar:
             # need at least two columns to operate, unless we are adding
             # another value
             return None, None  # waiting for parameter, do nothing
 
-        series = table[colnames].agg(self.agg, axis=1)
-        series.name = self.default_result_column_name(colnames)
-
-        # Optional add/multiply all rows by a scalar
+        # Optional add/multiply all rows by a scalar (or each row by its own)
         if extra_scalar:
+            error = self._check_key_columns(params, input_columns)
+            if error is not None:
+                return error, None
+        if extra_scalar and params["single_value_selector"] == "row_lookup":
+            val = self._get_row_lookup_values(table, params)
+        elif extra_scalar:
             val = self._get_single_value(table, params)
-            if isinstance(val, i18n.I18nMessage):
-                return val, None  # error essage
-            if self.agg == "sum":
-                series += val
+        else:
+            val = None
+        if isinstance(val, i18n.I18nMessage):
+            return val, None  # error essage
+        per_row = isinstance(val, np.ndarray)
+        if (
+            val is not None
+            and params["exact_fixed_point"]
+            and params["single_value_selector"] in {"cell", "lookup"}
+            and params["single_value_col"] in input_columns
+        ):
+            # Round the cell to its column's format, as exact mode rounds
+            # every column: else a drifted cell (0.30000000000000004) would
+            # need 17 decimal places and we'd fall back to floats
+            scale = _number_format_scale(
+                input_columns[params["single_value_col"]].format
+            )
+            if scale is not None and scale <= FixedPointMaxScale:
+                val = float(np.rint(val * 10.0 ** scale) / 10.0 ** scale)
+
+        def compute(data, masks, rows=slice(None)):
+            if params["null_policy"] == "zero":
+                data = _zero_filled_columns(data, colnames, masks)
+            # "default" and "skip" are what DataFrame.agg() does natively
+            return self._agg(
+                data, colnames, columns, val[rows] if per_row else val, params
+            )
+
+        if plan.strategy == "column_streaming":
+            series, counts = _streaming_agg(
+                table, colnames, self.agg, val, params["null_policy"] == "zero"
+            )
+            result_mask = _null_policy_count_mask(counts, len(colnames), params)
+        elif plan.strategy == "row_chunked":
+            series = _compute_in_chunks(
+                table,
+                plan.chunk_rows,
+                lambda chunk, rows: _compute_with_null_policy(
+                    chunk,
+                    colnames,
+                    params,
+                    lambda data, masks: compute(data, masks, rows),
+                ),
+            )
+            result_mask = None  # each chunk applied it
+        else:
+            masks = _validity_masks(table, colnames)
+            if (
+                params["null_policy"] == "zero"
+                or per_row
+                or _is_timestamp(table[colnames[0]])
+            ):
+                positions = None  # empty rows' results would differ
+            else:
+                positions = _sparse_row_positions(
+                    masks, need_all=False, threshold=SparseDensityThreshold
+                )
+            if positions is None:
+                series = compute(table, masks)
             else:
-                series *= val
+                # Rows with only nulls all get the same value (e.g., sum => 0)
+                empty_row = pd.DataFrame({colname: [np.nan] for colname in colnames})
+                series = _compute_sparse(
+                    table,
+                    colnames,
+                    positions,
+                    lambda subtable: self._agg(
+                        subtable, colnames, columns, val, params
+                    ),
+                    self._agg(empty_row, colnames, columns, val, params).iloc[0],
+                )
+            result_mask = _null_policy_result_mask(masks, params)
+
+        if result_mask is not None:
+            series = series.where(result_mask)
+
+        series.name = self.default_result_column_name(colnames)
 
         return series, columns[0].format
 
 
-@dataclass
 class BinaryOp:
-    fn: Callable
-    """Function to operate on two Series, plus (optinally) their formats, returning a Series.
-    Formats will be passed if this function takes 4 args, not usual 2"""
+    def __init__(
+        self,
+        fn: Callable,
+        default_result_column_name_format: str,
+        override_result_column_format: Optional[Callable[[str, str], str]] = None,
+        fixed_point_fn: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+        timestamp_fn: Optional[Callable[[pd.Series, pd.Series, str], pd.Series]] = None,
+    ):
+        self.fn = fn
+        """Function to operate on two Series, plus (optinally) their formats,
+        returning a Series. Formats will be passed if this function takes 4
+        args, not usual 2"""
+
+        self.default_result_column_name_format = default_result_column_name_format
+        """op.default_result_column_format.format('x', 'y') => 'x minus y'."""
+
+        self.override_result_column_format = override_result_column_format
+        """Return result column format, given input colunmn formats (e.g.,
+        '{:,.1%}')."""
 
-    default_result_column_name_format: str
-    """op.default_result_column_format.format('x', 'y') => 'x minus y'."""
+        self.fixed_point_fn = fixed_point_fn
+        """Function to operate on two int64 arrays of the same scale, in exact mode.
+        Its result must have that same scale (e.g., subtraction)."""
 
-    override_result_column_format: Optional[Callable[[str, str], str]] = None
-    """Return result column format, given input colunmn formats (e.g., '{:,.1%}')."""
+        self.timestamp_fn = timestamp_fn
+        """Function to operate on two timestamp Series, given a duration_unit,
+        returning a number Series."""
+
+        self.accepts_timestamps = timestamp_fn is not None
+        """True if render() can operate on timestamp columns."""
 
     def default_result_column_name(self, col1: str, col2: str) -> str:
         """op.default_result_column_name('x', 'y') => 'Sum of x, y'."""
         return self.default_result_column_name_format.format(col1=col1, col2=col2)
 
-    def render(self, table, params, input_columns) -> Dict[str, Any]:
+    def input_colnames(self, params) -> List[str]:
+        """Columns `render()` reads numbers from; empty if it's waiting."""
+        if not params["col1"] or not params["col2"]:
+            return []
+        return [params["col1"], params["col2"]]
+
+    def _compute(self, table, col1, col2, params) -> pd.Series:
+        if self.accepts_timestamps and _is_timestamp(table[col1.name]):
+            return self.timestamp_fn(
+                table[col1.name], table[col2.name], params["duration_unit"]
+            )
+
+        if params["exact_fixed_point"] and self.fixed_point_fn is not None:
+            series = _fixed_point_binary(table, col1, col2, self.fixed_point_fn)
+            if series is not None:
+                return series
+
+        if self.fn.__code__.co_argcount == 2:
+            return self.fn(table[col1.name], table[col2.name])
+        else:
+            return self.fn(table[col1.name], table[col2.name], col1.format, col2.format)
+
+    def memory_per_row(
+        self, table, params
+    ) -> Tuple[float, Optional[float], Optional[float]]:
+        """
+        Estimate peak bytes per row `render()` allocates.
+
+        See `MulticolumnOp.memory_per_row()`.
+        """
+        whole_table = 2.5  # operands, result and a temporary or two
+        colnames = self.input_colnames(params)
+        if self.accepts_timestamps and colnames and _is_timestamp(table[colnames[0]]):
+            whole_table = 3.5  # int64 difference, overflow mask and result
+        if params["exact_fixed_point"] and self.fixed_point_fn is not None:
+            whole_table += 6  # 2-D scaled copies
+        if params["null_policy"] == "zero":
+            whole_table += 3
+        row_chunked_overhead = 1.25  # output; masks are per chunk
+        return whole_table * 8, None, row_chunked_overhead * 8
+
+    def render(self, table, params, input_columns, plan) -> Dict[str, Any]:
         if not params["col1"] or not params["col2"]:
             return None, None  # waiting for parameter -- no-op
 
         col1 = input_columns[params["col1"]]
         col2 = input_columns[params["col2"]]
 
-        if len(signature(self.fn).parameters) == 2:
-            series = self.fn(table[col1.name], table[col2.name])
-        else:
-            series = self.fn(
-                table[col1.name],
-                table[col2.name],
-                input_columns[col1.name].format,
-                input_columns[col2.name].format,
+        colnames = [col1.name, col2.name]
+
+        def compute(data, masks):
+            if params["null_policy"] == "zero":
+                data = _zero_filled_columns(data, colnames, masks)
+            return self._compute(data, col1, col2, params)
+
+        if plan.strategy == "row_chunked":
+            series = _compute_in_chunks(
+                table,
+                plan.chunk_rows,
+                lambda chunk, rows: _compute_with_null_policy(
+                    chunk, colnames, params, compute
+                ),
             )
+        else:
+            # "default" and "skip" are what arithmetic does natively: there is
+            # no way to skip one operand, so a null operand gives a null result.
+            if (
+                params["null_policy"] in {"propagate", "zero", "min_count"}
+                or BinarySparseDensityThreshold > 0
+            ):
+                masks = _validity_masks(table, colnames)
+            else:
+                masks = None
+
+            if masks is not None and params["null_policy"] != "zero":
+                positions = _sparse_row_positions(
+                    masks, need_all=True, threshold=BinarySparseDensityThreshold
+                )
+            else:
+                positions = None
+
+            if positions is None:
+                series = compute(table, masks)
+            else:
+                series = _compute_sparse(
+                    table,
+                    colnames,
+                    positions,
+                    lambda subtable: self._compute(subtable, col1, col2, params),
+                    np.nan,
+                )
+
+            if masks is not None:
+                result_mask = _null_policy_result_mask(masks, params)
+                if result_mask is not None:
+                    series = series.where(result_mask)
+
         series.name = self.default_result_column_name(col1.name, col2.name)
 
-        if self.override_result_column_format:
+        if col1.type == "timestamp":
+            newcolformat = DurationFormat
+        elif self.override_result_column_format:
             newcolformat = self.override_result_column_format(
                 input_columns[col1.name].format, input_columns[col2.name].format
             )
@@ -141,31 +1335,80 @@ class BinaryOp:
         return series, newcolformat
 
 
-@dataclass
 class UnaryOp:
     """
     Single-column operations (Percent of column sum).
     """
 
-    fn: Callable[[pd.Series], pd.Series]
-    """Function to operate on column"""
+    def __init__(
+        self,
+        fn: Callable[[pd.Series], pd.Series],
+        default_result_column_name_format: str,
+        override_result_column_format: Optional[str] = None,
+        accurate_fn: Optional[Callable[[pd.Series], pd.Series]] = None,
+    ):
+        self.fn = fn
+        """Function to operate on column"""
+
+        self.default_result_column_name_format = default_result_column_name_format
+        """op.default_result_column_name_format.format('x', 'y') => 'x minus y'."""
 
-    default_result_column_name_format: str
-    """op.default_result_column_name_format.format('x', 'y') => 'x minus y'."""
+        self.override_result_column_format = override_result_column_format
+        """Python format string to force, if needed (e.g., '{:,.1%}')."""
 
-    override_result_column_format: Optional[str] = None
-    """Python format string to force, if needed (e.g., '{:,.1%}')."""
+        self.accurate_fn = accurate_fn
+        """Function to use instead of `fn` when the user asks for an accurate sum."""
+
+        self.accepts_timestamps = False
+        """Timestamps have no column sum."""
 
     def default_result_column_name(self, col1: str) -> str:
         """op.default_result_column_name('x') => 'Percent of x'."""
         return self.default_result_column_name_format.format(col=col1)
 
-    def render(self, table, params, input_columns) -> Dict[str, Any]:
+    def input_colnames(self, params) -> List[str]:
+        """Columns `render()` reads numbers from; empty if it's waiting."""
+        return [params["col1"]] if params["col1"] else []
+
+    def memory_per_row(
+        self, table, params
+    ) -> Tuple[float, Optional[float], Optional[float]]:
+        """
+        Estimate peak bytes per row `render()` allocates.
+
+        The column sum needs every row, so there is no streaming or chunking.
+        See `MulticolumnOp.memory_per_row()`.
+        """
+        whole_table = 2.5  # null-policy copy, result and a temporary
+        if params["accurate_sum"] and self.accurate_fn is not None:
+            whole_table += 3  # padded copy and Neumaier temporaries
+        return whole_table * 8, None, None
+
+    def render(self, table, params, input_columns, plan) -> Dict[str, Any]:
         if not params["col1"]:
             return None, None  # waiting for parameter -- no-op
 
         col1 = params["col1"]
-        series = self.fn(table[col1])
+        column = table[col1]
+
+        # "default" and "skip" are what Series.sum() does natively. Other
+        # policies apply to the column sum, so they null the whole column.
+        if params["null_policy"] in {"propagate", "zero", "min_count"}:
+            [mask] = _validity_masks(table, [col1])
+            if params["null_policy"] == "zero":
+                column = column.where(mask, 0)
+            else:
+                if params["null_policy"] == "propagate":
+                    min_count = len(mask)
+                else:
+                    min_count = params["null_min_count"]
+                if mask.sum() < min_count:
+                    column = pd.Series(np.nan, index=table.index, name=col1)
+
+        if params["accurate_sum"] and self.accurate_fn:
+            series = self.accurate_fn(column)
+        else:
+            series = self.fn(column)
 
         if isinstance(series, i18n.I18nMessage):
             return series, None  # error message
@@ -175,71 +1418,239 @@ class UnaryOp:
 
 
 PercentFormat = "{:,.1%}"
+DurationFormat = "{:,}"
 PercentFormatCallable = lambda x_fmt, y_fmt: PercentFormat
 
-Operations = {
-    "add": MulticolumnOp("sum", "Sum of {cols}"),
-    "subtract": BinaryOp(lambda x, y: x - y, "{col1} minus {col2}"),
-    "multiply": MulticolumnOp("product", "Product of {cols}"),
-    "divide": BinaryOp(
-        lambda x, y: (x / y).replace([np.inf, -np.inf], np.nan),
-        "{col1} divided by {col2}",
-    ),
-    "mean": MulticolumnOp("mean", "Average of {cols}"),
-    "median": MulticolumnOp("median", "Median of {cols}"),
-    "minimum": MulticolumnOp("min", "Minimum of {cols}"),
-    "maximum": MulticolumnOp("max", "Maximum of {cols}"),
-    "percent_change": BinaryOp(
-        lambda x, y: ((y - x) / x).replace([np.inf, -np.inf], np.nan),
-        "Percent change {col1} to {col2}",
-        PercentFormatCallable,
-    ),
-    "percent_multiply": BinaryOp(
-        lambda x, y, x_fmt, y_fmt: x * y if x_fmt == "{:,.1%}" else x * y / 100,
-        "{col1} percent of {col2}",
-        lambda x_fmt, y_fmt: y_fmt,
-    ),
-    "percent_divide": BinaryOp(
-        lambda x, y: (x / y).replace([np.inf, -np.inf], np.nan),
-        "{col1} is this percent of {col2}",
-        PercentFormatCallable,
-    ),
-    "percent_of_column_sum": UnaryOp(
-        (
-            lambda x: (x / x.sum())
-            if (all(x.isna()) or x.sum() != 0)
-            else i18n.trans(
-                "badData.percent_of_column_sum.sumIsZero", "Column sum is 0."
-            )
+
+def _percent_of_column_sum(x: pd.Series, column_sum: float):
+    if all(x.isna()) or column_sum != 0:
+        return x / column_sum
+    else:
+        return i18n.trans(
+            "badData.percent_of_column_sum.sumIsZero", "Column sum is 0."
+        )
+
+
+def _build_operations() -> Dict[str, Any]:
+    return {
+        "add": MulticolumnOp("sum", "Sum of {cols}", _compensated_row_sum),
+        "subtract": BinaryOp(
+            lambda x, y: x - y,
+            "{col1} minus {col2}",
+            fixed_point_fn=lambda x, y: x - y,
+            timestamp_fn=_timestamp_difference,
         ),
-        "Percent of {col}",
-        PercentFormat,
-    ),
-}
+        "multiply": MulticolumnOp("product", "Product of {cols}"),
+        "divide": BinaryOp(
+            lambda x, y: (x / y).replace([np.inf, -np.inf], np.nan),
+            "{col1} divided by {col2}",
+        ),
+        "mean": MulticolumnOp("mean", "Average of {cols}", _compensated_row_mean),
+        "median": MulticolumnOp("median", "Median of {cols}"),
+        "minimum": MulticolumnOp("min", "Minimum of {cols}"),
+        "maximum": MulticolumnOp("max", "Maximum of {cols}"),
+        "percent_change": BinaryOp(
+            lambda x, y: ((y - x) / x).replace([np.inf, -np.inf], np.nan),
+            "Percent change {col1} to {col2}",
+            PercentFormatCallable,
+        ),
+        "percent_multiply": BinaryOp(
+            lambda x, y, x_fmt, y_fmt: x * y if x_fmt == "{:,.1%}" else x * y / 100,
+            "{col1} percent of {col2}",
+            lambda x_fmt, y_fmt: y_fmt,
+        ),
+        "percent_divide": BinaryOp(
+            lambda x, y: (x / y).replace([np.inf, -np.inf], np.nan),
+            "{col1} is this percent of {col2}",
+            PercentFormatCallable,
+        ),
+        "percent_of_column_sum": UnaryOp(
+            lambda x: _percent_of_column_sum(x, x.sum()),
+            "Percent of {col}",
+            PercentFormat,
+            accurate_fn=lambda x: _percent_of_column_sum(x, _compensated_sum(x)),
+        ),
+    }
 
 
-def render(table, params, *, input_columns, settings):
-    operation = Operations[params["operation"]]
-    series_or_error, format = operation.render(table, params, input_columns)
+def _operations() -> Dict[str, Any]:
+    """
+    Return `Operations`, building it on first use.
+
+    `migrate_params()` doesn't need `Operations`, so we don't build it on
+    import.
+    """
+    operations = globals().get("Operations")
+    if operations is None:
+        operations = globals()["Operations"] = _build_operations()
+    return operations
+
+
+def __getattr__(name: str):
+    # PEP 562: `calculate.Operations` works before `render()` builds it
+    if name == "Operations":
+        return _operations()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def plan_execution(table, params, *, budget: Optional[int] = None) -> ExecutionPlan:
+    """
+    Decide how `render()` will compute, to fit in `budget` (or MemoryBudget).
+
+    We estimate peak bytes from the number of rows, the operation and its
+    params, plus the cost of parsing any text columns it reads. We compute all rows at once if that fits; otherwise we stream
+    columns one by one, if the operation can and that fits; otherwise we
+    compute as many rows at a time as fit. If nothing fits, we pick the
+    strategy with the smallest estimate.
+    """
+    if budget is None:
+        budget = MemoryBudget
+    operation = _operations()[params["operation"]]
+    n_rows = len(table)
+    whole_table, column_streaming, row_chunked_overhead = operation.memory_per_row(
+        table, params
+    )
+    if params["parse_text_numbers"]:
+        parse_colnames = [
+            c
+            for c in dict.fromkeys(operation.input_colnames(params))
+            if c in table.columns and _is_text(table[c])
+        ]
+    else:
+        parse_colnames = []
+    parsed, parsing = _parse_text_memory(table, parse_colnames)
+
+    estimates = {"whole_table": int((whole_table + parsed) * n_rows + parsing)}
+    if column_streaming is not None:
+        estimates["column_streaming"] = int(
+            (column_streaming + parsed) * n_rows + parsing
+        )
+    if row_chunked_overhead is not None and whole_table > 0:
+        overhead = (row_chunked_overhead + parsed) * n_rows + parsing
+        chunk_rows = max(MinChunkRows, int((budget - overhead) // whole_table))
+        if chunk_rows < n_rows:
+            estimates["row_chunked"] = int(overhead + whole_table * chunk_rows)
+    else:
+        chunk_rows = None
+
+    fitting = [strategy for strategy, nbytes in estimates.items() if nbytes <= budget]
+    if fitting:
+        strategy = fitting[0]  # estimates are in order of preference
+    else:
+        strategy = min(estimates, key=estimates.get)
+    return ExecutionPlan(
+        strategy,
+        estimates[strategy],
+        budget,
+        estimates,
+        chunk_rows if strategy == "row_chunked" else None,
+    )
+
+
+_IgnoringFragmentationWarnings = False
+"""True once `_append_column()` has told `warnings` to ignore fragmentation."""
+
+
+def _append_column(table: pd.DataFrame, colname: str, series: pd.Series) -> None:
+    """
+    Set `table[colname] = series` without copying `table`'s other columns.
+
+    pandas stores the result as a block of its own: it doesn't consolidate
+    (that would copy every column) or realign `series`, which is indexed like
+    `table`. Past 100 blocks, pandas warns and suggests consolidating; on a
+    wide table that's the very copy we avoid, so we don't pass the warning on.
+
+    We add one process-wide filter for that warning from this module, rather
+    than `warnings.catch_warnings()`, which isn't thread-safe.
+    """
+    global _IgnoringFragmentationWarnings
+    if not _IgnoringFragmentationWarnings:
+        import re  # only when calculating: it's slow to import
+
+        warnings.filterwarnings(
+            "ignore",
+            category=pd.errors.PerformanceWarning,
+            module=re.escape(__name__) + r"\Z",
+        )
+        _IgnoringFragmentationWarnings = True
+    table[colname] = series
+
+
+def render(table, params, *, input_columns, settings, result_only=False):
+    """
+    Calculate a column and append it to `table`.
+
+    If `result_only`, leave `table` alone and return a DataFrame with just
+    the new column (or no columns, when we're waiting for params). A host
+    that already holds the table needs nothing else, so it needn't receive --
+    or serialize -- every other column again.
+    """
+    operation = _operations()[params["operation"]]
+
+    input_colnames = [
+        colname
+        for colname in operation.input_colnames(params)
+        if colname in input_columns
+    ]
+    text_colnames = [c for c in input_colnames if input_columns[c].type == "text"]
+    timestamp_colnames = [
+        c for c in input_colnames if input_columns[c].type == "timestamp"
+    ]
+    if timestamp_colnames:
+        if not operation.accepts_timestamps:
+            return i18n.trans(
+                "badParam.timestamp.operation",
+                "“{column}” is a timestamp. This operation only works with numbers.",
+                {"column": timestamp_colnames[0]},
+            )
+        elif len(timestamp_colnames) < len(input_colnames):
+            return i18n.trans(
+                "badParam.timestamp.mixed",
+                "Please select only timestamps, or only numbers.",
+            )
+        elif params["null_policy"] == "zero":
+            return i18n.trans(
+                "badParam.timestamp.zero",
+                "Timestamps can't be 0. Please choose another way to handle nulls.",
+            )
+    if text_colnames and not params["parse_text_numbers"]:
+        return i18n.trans(
+            "badParam.parse_text_numbers.textColumn",
+            "“{column}” is text. Convert it to numbers, or parse numbers in text.",
+            {"column": text_colnames[0]},
+        )
+
+    plan = plan_execution(table, params)  # before parsing: it counts parsing
+    if text_colnames:
+        data, data_columns, parse_warnings = _parse_text_inputs(
+            table, text_colnames, input_columns
+        )
+    else:
+        data, data_columns, parse_warnings = table, input_columns, []
+    series_or_error, format = operation.render(data, params, data_columns, plan)
 
     if series_or_error is None:
-        return table  # Waiting for parameter -- no-op
+        # Waiting for parameter -- no-op
+        return pd.DataFrame(index=table.index) if result_only else table
     elif isinstance(series_or_error, pd.Series):
         if params["outcolname"]:
             colname = params["outcolname"]
             errors = []
         else:
-            colnames, errors = gen_unique_clean_colnames_and_warn(
+            colnames, errors = _colnames.gen_unique_clean_colnames_and_warn(
                 [series_or_error.name],
                 existing_names=list(input_columns.keys()),
                 settings=settings,
             )
             colname = colnames[0]
-        table[colname] = series_or_error
+        if result_only:
+            table = series_or_error.rename(colname).to_frame()
+        else:
+            _append_column(table, colname, series_or_error)
         return {
             "dataframe": table,
-            "errors": errors,
-            "column_formats": {colname: format},
+            "errors": parse_warnings + errors,
+            "column_formats": {} if format is None else {colname: format},
         }
     else:
         return series_or_error
@@ -265,28 +1676,34 @@ def _migrate_params_v0_to_v1(params):
     }
 
 
+V1Operations = {
+    0: "add",
+    1: "subtract",
+    2: "multiply",
+    3: "divide",
+    # separator
+    5: "mean",
+    6: "median",
+    7: "minimum",
+    8: "maximum",
+    # separator
+    10: "percent_change",
+    11: "percent_multiply",
+    12: "percent_divide",
+    # separator
+    13: "percent_of_column_sum",
+}
+"""v1 numeric "operation" menu value => v2 text value."""
+
+V1SingleValueSelectors = {0: "none", 1: "cell", 2: "constant"}
+"""v1 numeric "single_value_selector" menu value => v2 text value."""
+
+
 def _migrate_params_v1_to_v2(params):
     """v1: menus are numeric; v2: menus are text."""
     return {
-        **params,
-        "operation": {
-            0: "add",
-            1: "subtract",
-            2: "multiply",
-            3: "divide",
-            # separator
-            5: "mean",
-            6: "median",
-            7: "minimum",
-            8: "maximum",
-            # separator
-            10: "percent_change",
-            11: "percent_multiply",
-            12: "percent_divide",
-            # separator
-            13: "percent_of_column_sum",
-        }.get(params["operation"], "add"),
-        "single_value_selector": {0: "none", 1: "cell", 2: "constant"}.get(
+        "operation": V1Operations.get(params["operation"], "add"),
+        "single_value_selector": V1SingleValueSelectors.get(
             params["single_value_selector"], "none"
         ),
     }
@@ -294,14 +1711,56 @@ def _migrate_params_v1_to_v2(params):
 
 def _migrate_params_v2_to_v3(params):
     """v2: colnames is comma-separated str. v3: it's List[str]."""
-    return {**params, "colnames": [c for c in params["colnames"].split(",") if c]}
+    return {"colnames": [c for c in params["colnames"].split(",") if c]}
+
+
+def _is_v0(params):
+    """True if `params` have statictext values, or predate outcolname."""
+    return "xtext" in params or "outcolname" not in params
+
+
+MigrationSteps = [
+    ("operation", int, _migrate_params_v1_to_v2),
+    ("colnames", str, _migrate_params_v2_to_v3),
+    # v3: no exact_fixed_point. v4: exact_fixed_point defaults to False.
+    ("exact_fixed_point", None, {"exact_fixed_point": False}),
+    # v4: no accurate_sum. v5: accurate_sum defaults to False.
+    ("accurate_sum", None, {"accurate_sum": False}),
+    # v5: nulls handled implicitly. v6: null_policy (default "default").
+    ("null_policy", None, {"null_policy": "default", "null_min_count": 1}),
+    # v6: only number columns. v7: parse_text_numbers (default False).
+    ("parse_text_numbers", None, {"parse_text_numbers": False}),
+    # v7: only number inputs for subtract. v8: duration_unit (default "days").
+    ("duration_unit", None, {"duration_unit": "days"}),
+    # v8: single value by row number. v9: or by key (default no key).
+    (
+        "single_value_key_col",
+        None,
+        {
+            "single_value_key_col": "",
+            "single_value_key": "",
+            "single_value_row_key_col": "",
+        },
+    ),
+]
+"""
+`(key, old_type, updates)` for v1 => v2, v2 => v3, etc., in order.
+
+Params need a step if `params[key]` is an `old_type` -- or, if `old_type`
+is None, if `key` is missing. `updates` is the dict of keys to add, or a
+function returning the keys to change. Every migrator (`migrate_params()`,
+calculate_migrate.py) walks this list: to add a version, append to it.
+"""
+
+CurrentVersion = len(MigrationSteps) + 1
 
 
 def migrate_params(params):
-    if "xtext" in params or "outcolname" not in params:
+    if _is_v0(params):
         params = _migrate_params_v0_to_v1(params)
-    if isinstance(params["operation"], int):
-        params = _migrate_params_v1_to_v2(params)
-    if isinstance(params["colnames"], str):
-        params = _migrate_params_v2_to_v3(params)
+    for key, old_type, updates in MigrationSteps:
+        if key not in params if old_type is None else isinstance(params[key], old_type):
+            if callable(updates):
+                updates = updates(params)
+            params = {**params, **updates}
     return params
@@ -0,0 +1,147 @@
+"""
+Migrate many stored params at once, for fleet-wide upgrades.
+
+    python calculate_migrate.py [--batch-size N] < old.jsonl > new.jsonl
+
+Reads one params dict per line, migrates each with
+`calculate.migrate_params()` and writes the results, in the same order.
+Migrated params that don't match calculate.yaml are reported on stderr, along
+with throughput and how many params were already up to date.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import calculate
+
+Params = Dict[str, Any]
+
+SpecPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculate.yaml")
+
+
+def load_param_validators(
+    spec_path: str = SpecPath,
+) -> Dict[str, Callable[[Any], bool]]:
+    """
+    Return a validator per param id_name in the module spec (calculate.yaml).
+    """
+    import yaml
+
+    with open(spec_path) as f:
+        spec = yaml.safe_load(f)
+
+    def is_str(value):
+        return isinstance(value, str)
+
+    def is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def is_number(value):
+        return is_int(value) or isinstance(value, float)
+
+    def is_bool(value):
+        return isinstance(value, bool)
+
+    def is_str_list(value):
+        return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+    def is_one_of(options):
+        values = frozenset(
+            option["value"] for option in options if option != "separator"
+        )
+        return lambda value: is_str(value) and value in values
+
+    type_validators = {
+        "column": is_str,
+        "string": is_str,
+        "multicolumn": is_str_list,
+        "integer": is_int,
+        "float": is_number,
+        "checkbox": is_bool,
+    }
+
+    validators = {}
+    for param in spec["parameters"]:
+        if param["type"] == "statictext":
+            continue
+        elif param["type"] == "menu":
+            validators[param["id_name"]] = is_one_of(param["options"])
+        else:
+            validators[param["id_name"]] = type_validators[param["type"]]
+    return validators
+
+
+def validate_params_batch(
+    params_list: List[Params], validators: Dict[str, Callable[[Any], bool]]
+) -> List[Tuple[int, str]]:
+    """
+    Return `(index, message)` for each invalid params in `params_list`.
+    """
+    errors = []
+    expected_keys = set(validators)
+    valid_indices = []
+    for i, params in enumerate(params_list):
+        if params.keys() == expected_keys:
+            valid_indices.append(i)
+        else:
+            missing = sorted(expected_keys - params.keys())
+            extra = sorted(params.keys() - expected_keys)
+            errors.append((i, f"missing keys {missing}, unexpected keys {extra}"))
+
+    # Check one param at a time, across all params dicts
+    for key, is_valid in validators.items():
+        for i in valid_indices:
+            if not is_valid(params_list[i][key]):
+                errors.append((i, f"invalid {key}: {params_list[i][key]!r}"))
+
+    return sorted(errors)
+
+
+def _read_batches(lines: Iterator[str], batch_size: int) -> Iterator[List[Params]]:
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    validators = load_param_validators()
+    n_params = 0
+    n_current = 0
+    n_invalid = 0
+    start = time.perf_counter()
+    for batch in _read_batches(sys.stdin, args.batch_size):
+        migrated = [calculate.migrate_params(params) for params in batch]
+        # migrate_params() returns up-to-date params as-is
+        n_current += sum(new is old for new, old in zip(migrated, batch))
+        for i, message in validate_params_batch(migrated, validators):
+            print(f"params {n_params + i + 1}: {message}", file=sys.stderr)
+            n_invalid += 1
+        sys.stdout.writelines(json.dumps(params) + "\n" for params in migrated)
+        n_params += len(batch)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Migrated {n_params} params in {elapsed:.3f}s "
+        f"({n_params / max(elapsed, 1e-9):.0f} params/s); "
+        f"{n_current} already up to date; "
+        f"{n_invalid} invalid",
+        file=sys.stderr,
+    )
+    return 1 if n_invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Long-lived process that serves `calculate.render()` and `migrate_params()`.
+
+Starting Python and importing pandas often takes longer than the calculation
+itself. This worker imports `calculate` once, then answers requests over
+stdin/stdout or a Unix socket:
+
+    python calculate_worker.py [--socket PATH] [--threads N] [--max-queue N]
+                               [--memory-budget BYTES]
+
+Each message is a JSON header line, followed by `header["table_length"]`
+bytes of Arrow IPC stream (if `table_length` is nonzero). Requests look like:
+
+    {"id": 1, "method": "migrate_params", "params": {...}}
+    {"id": 2, "method": "render", "params": {...},
+     "input_columns": {"A": {"type": "number", "format": "{:,}"}},
+     "settings": {"MAX_BYTES_PER_COLUMN_NAME": 120}, "table_length": 1234}
+
+A render request may set `"result_only": true`: then its response table holds
+just the new column (or no columns), not the whole table again. For a wide
+table, that saves converting and sending every other column back.
+
+Responses echo `id` and report `queue_ms` (time waiting for a thread) and
+`elapsed_ms` (time from receipt to response). They may arrive out of order.
+Render responses log `plan`: how `calculate` chose to fit its memory budget.
+
+    {"id": 1, "params": {...}, ...}
+    {"id": 2, "errors": [], "column_formats": {...}, "table_length": 2345,
+     "plan": {"strategy": "whole_table", "estimated_bytes": 456, ...}, ...}
+    {"id": 3, "exception": "Traceback ...", ...}
+
+After a malformed message, the worker responds `{"id": null, "exception":
+...}`, answers the requests it has already read and closes the connection.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import stat
+import sys
+import threading
+import time
+import traceback
+from typing import Any, BinaryIO, Callable, Dict, NamedTuple, Optional, Tuple
+
+import calculate
+import pandas as pd
+import pyarrow as pa
+from cjwmodule.i18n import I18nMessage
+
+Message = Tuple[Dict[str, Any], Optional[pd.DataFrame]]
+
+
+class Column(NamedTuple):
+    name: str
+    type: str
+    format: Optional[str]
+
+
+class Settings(NamedTuple):
+    MAX_BYTES_PER_COLUMN_NAME: int = 120
+
+
+def read_message(rfile: BinaryIO) -> Optional[Message]:
+    """
+    Read a header and (optional) table from `rfile`; return None on EOF.
+    """
+    line = rfile.readline()
+    if not line:
+        return None
+    header = json.loads(line)
+    table_length = header.get("table_length", 0)
+    if table_length:
+        body = rfile.read(table_length)
+        if len(body) != table_length:
+            raise EOFError("Stream ended in the middle of a table")
+        table = pa.ipc.open_stream(body).read_pandas()
+    else:
+        table = None
+    return header, table
+
+
+def encode_message(
+    header: Dict[str, Any], table: Optional[pd.DataFrame] = None
+) -> bytes:
+    """
+    Serialize a header and (optional) table, as `write_message()` sends them.
+    """
+    if table is None:
+        body = b""
+        header = {**header, "table_length": 0}
+    else:
+        arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        body = sink.getvalue().to_pybytes()
+        header = {**header, "table_length": len(body)}
+    return json.dumps(header).encode("utf-8") + b"\n" + body
+
+
+def write_message(
+    wfile: BinaryIO, header: Dict[str, Any], table: Optional[pd.DataFrame] = None
+) -> None:
+    """
+    Write a header and (optional) table to `wfile`, and flush.
+
+    Callers sharing `wfile` between threads must hold a lock.
+    """
+    wfile.write(encode_message(header, table))
+    wfile.flush()
+
+
+def _i18n_message_to_dict(message: I18nMessage) -> Dict[str, Any]:
+    return {"id": message.id, "arguments": message.arguments, "source": message.source}
+
+
+def handle_request(header: Dict[str, Any], table: Optional[pd.DataFrame]) -> Message:
+    """
+    Call `calculate`, and return a response header and (optional) table.
+    """
+    method = header["method"]
+    if method == "migrate_params":
+        return {"params": calculate.migrate_params(header["params"])}, None
+    elif method == "render":
+        input_columns = {
+            name: Column(name, column["type"], column.get("format"))
+            for name, column in header["input_columns"].items()
+        }
+        plan = {"plan": vars(calculate.plan_execution(table, header["params"]))}
+        result = calculate.render(
+            table,
+            header["params"],
+            input_columns=input_columns,
+            settings=Settings(**header.get("settings", {})),
+            result_only=header.get("result_only", False),
+        )
+        if isinstance(result, pd.DataFrame):
+            return {"errors": [], "column_formats": {}, **plan}, result
+        elif isinstance(result, I18nMessage):
+            return {"errors": [_i18n_message_to_dict(result)], **plan}, None
+        else:
+            return (
+                {
+                    "errors": [_i18n_message_to_dict(e) for e in result["errors"]],
+                    "column_formats": result["column_formats"],
+                    **plan,
+                },
+                result["dataframe"],
+            )
+    else:
+        raise ValueError("Unknown method %r" % method)
+
+
+class Worker:
+    """
+    Thread pool that handles requests from any number of connections.
+
+    At most `max_queue` requests wait for a thread: past that, `submit()`
+    blocks, so clients feel back-pressure instead of growing our memory.
+    """
+
+    def __init__(self, n_threads: int = 1, max_queue: int = 8):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(n_threads)
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Finish queued requests, then stop all threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def submit(
+        self,
+        header: Dict[str, Any],
+        table: Optional[pd.DataFrame],
+        respond: Callable[[Dict[str, Any], Optional[pd.DataFrame]], None],
+    ) -> None:
+        """
+        Queue a request; a worker thread will call `respond()` with the response.
+        """
+        self._queue.put((time.perf_counter(), header, table, respond))
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            received_at, header, table, respond = job
+            started_at = time.perf_counter()
+            try:
+                response, response_table = handle_request(header, table)
+            except Exception:
+                response, response_table = {"exception": traceback.format_exc()}, None
+            finished_at = time.perf_counter()
+            response = {
+                "id": header.get("id"),
+                **response,
+                "queue_ms": (started_at - received_at) * 1000,
+                "elapsed_ms": (finished_at - received_at) * 1000,
+            }
+            try:
+                respond(response, response_table)
+            except Exception:
+                traceback.print_exc()  # and keep serving other clients
+
+    def serve(self, rfile: BinaryIO, wfile: BinaryIO) -> None:
+        """
+        Answer requests from `rfile` on `wfile`; return after responding to all.
+
+        If `rfile` holds something that isn't a message, we can't find the
+        next message after it: we respond with an exception (with `"id":
+        null`), stop reading, and finish the requests we've already read.
+        A response we can't serialize becomes an exception response with the
+        same id. If `wfile` is closed, we drop responses instead of failing.
+        """
+        write_lock = threading.Lock()
+        done = threading.Condition()
+        n_pending = 0
+
+        def respond(header, table):
+            nonlocal n_pending
+            try:
+                try:
+                    data = encode_message(header, table)
+                except Exception:
+                    # e.g., a column Arrow can't convert. The client is still
+                    # waiting for this id: tell it what went wrong.
+                    data = encode_message(
+                        {"id": header.get("id"), "exception": traceback.format_exc()}
+                    )
+                with write_lock:
+                    try:
+                        wfile.write(data)
+                        wfile.flush()
+                    except (OSError, ValueError):
+                        pass  # the client hung up; nobody is waiting for a response
+            finally:
+                with done:
+                    n_pending -= 1
+                    done.notify_all()
+
+        while True:
+            try:
+                message = read_message(rfile)
+            except Exception:
+                with done:
+                    n_pending += 1
+                respond({"id": None, "exception": traceback.format_exc()}, None)
+                break
+            if message is None:
+                break
+            with done:
+                n_pending += 1
+            self.submit(*message, respond)
+
+        with done:
+            done.wait_for(lambda: n_pending == 0)
+
+    def serve_socket(self, server: socket.socket) -> None:
+        """
+        Serve each connection to the listening socket `server` until it closes.
+        """
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return  # server was closed
+            threading.Thread(
+                target=self._serve_connection, args=(connection,), daemon=True
+            ).start()
+
+    def _serve_connection(self, connection: socket.socket) -> None:
+        with connection, connection.makefile("rb") as rfile:
+            wfile = connection.makefile("wb")
+            try:
+                self.serve(rfile, wfile)
+            finally:
+                try:
+                    wfile.close()  # flushes
+                except OSError:
+                    pass  # the client hung up before reading its responses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--socket", help="Unix socket path (default: stdin/stdout)")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--max-queue", type=int, default=8)
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=calculate.MemoryBudget,
+        help="bytes each render may allocate (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    calculate.MemoryBudget = args.memory_budget
+
+    worker = Worker(args.threads, args.max_queue)
+    worker.start()
+    if args.socket:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            # A worker that died can't unlink its socket; its file would make
+            # bind() fail with "Address already in use"
+            if os.path.exists(args.socket) and stat.S_ISSOCK(
+                os.stat(args.socket).st_mode
+            ):
+                os.unlink(args.socket)
+            server.bind(args.socket)
+            server.listen()
+            worker.serve_socket(server)
+    else:
+        worker.serve(sys.stdin.buffer, sys.stdout.buffer)
+    worker.stop()
+
+
+if __name__ == "__main__":
+    main()
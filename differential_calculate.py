@@ -0,0 +1,414 @@
+"""
+Differential tests for calculate.py: alternative engines vs. the reference.
+
+Usage: python differential_calculate.py [--seed N] [--cases N] [--rows N] [ENGINE ...]
+
+An "engine" is anything that renders like `calculate.render()`. We generate
+random tables (varied dtypes, formats and NaN/inf/zero placement; number,
+text and timestamp columns; key columns to look up) and params (including
+null policies) for every operation and single_value_selector mode, render
+each case with the plain pandas `render()` (the reference) and with each
+engine, and print one line per case: whether the results match
+(NaN-aware, within tolerance) and the engine's speedup over the reference.
+
+test_calculate.py runs every engine in `Engines` on small tables.
+"""
+import argparse
+import math
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+from unittest.mock import patch
+
+import calculate
+import numpy as np
+import pandas as pd
+from calculate_worker import Column, Settings
+
+Engine = Callable[[pd.DataFrame, Dict[str, Any], Dict[str, Column]], Any]
+
+DefaultRtol = 1e-9
+DefaultAtol = 1e-12
+
+Dtypes = ["float64", "float32", "int64", "int32"]
+
+Formats = ["{:,}", "{:,.2f}", "{:,.0f}", "{:,.1%}", "{:d}"]
+
+NullFractions = [0.0, 0.0, 0.1, 0.5, 0.9, 1.0]
+
+SingleValueSelectors = ["none", "cell", "constant", "lookup", "row_lookup"]
+
+ColumnTypes = ["number", "number", "number", "text", "timestamp"]
+"""Type of a case's columns: "text" makes about half of them text."""
+
+TextNumberFormats = ["{:,}", "{}", "${:,.2f}", "{:.1%}", "({:,.2f})", " {} "]
+
+Keys = ["a", "b", "c", "Total", None]
+"""Values of key columns: with repeats and nulls."""
+
+Constants = [0.0, 1.0, -2.5, 0.01, 1e6]
+
+NullPolicies = ["default", "default", "skip", "propagate", "zero", "min_count"]
+
+
+def default_params(**kwargs) -> Dict[str, Any]:
+    """
+    Return current-version params with default values, overridden by `kwargs`.
+
+    We build them by migrating v3 params, so params added later come with the
+    defaults their migrations give them.
+    """
+    v3_params = {
+        "operation": "add",
+        "colnames": [],
+        "col1": "",
+        "col2": "",
+        "single_value_selector": "none",
+        "single_value_col": "",
+        "single_value_row": 1,
+        "single_value_constant": 1.0,
+        "outcolname": "",
+    }
+    return calculate.migrate_params({**v3_params, **kwargs})
+
+
+def render_reference(table, params, input_columns):
+    return calculate.render(
+        table, params, input_columns=input_columns, settings=Settings()
+    )
+
+
+def render_with_params(**overrides) -> Engine:
+    """Return an engine that renders with `params` overridden."""
+
+    def render(table, params, input_columns):
+        return render_reference(table, {**params, **overrides}, input_columns)
+
+    return render
+
+
+def render_with_patches(**attributes) -> Engine:
+    """Return an engine that renders with `calculate` attributes patched."""
+
+    def render(table, params, input_columns):
+        with patch.multiple(calculate, **attributes):
+            return render_reference(table, params, input_columns)
+
+    return render
+
+
+def render_column_streaming(table, params, input_columns):
+    """Render with a MemoryBudget that forces column streaming, where possible."""
+    estimates = calculate.plan_execution(table, params, budget=0).estimates
+    budget = estimates.get("column_streaming", calculate.MemoryBudget)
+    with patch.object(calculate, "MemoryBudget", budget):
+        return render_reference(table, params, input_columns)
+
+
+Engines: Dict[str, Engine] = {
+    "exact_fixed_point": render_with_params(exact_fixed_point=True),
+    "accurate_sum": render_with_params(accurate_sum=True),
+    "dense": render_with_patches(
+        SparseDensityThreshold=0.0, BinarySparseDensityThreshold=0.0
+    ),
+    "sparse": render_with_patches(
+        SparseDensityThreshold=1.0, BinarySparseDensityThreshold=1.0
+    ),
+    "column_streaming": render_column_streaming,
+    "row_chunked": render_with_patches(MemoryBudget=0, MinChunkRows=3),
+}
+"""Alternative engines we expect to match the reference."""
+
+
+class Case(NamedTuple):
+    name: str
+    table: pd.DataFrame
+    params: Dict[str, Any]
+    input_columns: Dict[str, Column]
+
+
+class CaseResult(NamedTuple):
+    case: Case
+    engine: str
+    mismatch: Optional[str]
+    """Why the engine's result differs from the reference's; None if it matches."""
+    reference_seconds: float
+    engine_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / max(self.engine_seconds, 1e-9)
+
+
+def _random_column(
+    rng: np.random.Generator, n_rows: int, type: str
+) -> Tuple[Any, Optional[str]]:
+    """
+    Return `(values, format)` for a random column of `type`.
+    """
+    if type == "timestamp":
+        ticks = rng.integers(-(2 ** 62), 2 ** 62, n_rows)
+        values = ticks.astype("datetime64[ns]")
+        values[rng.random(n_rows) < rng.choice(NullFractions)] = np.datetime64("NaT")
+        return values, None
+
+    dtype = rng.choice(Dtypes)
+    if dtype.startswith("int"):
+        format = rng.choice(["{:,}", "{:d}"])
+    else:
+        format = rng.choice(Formats[:-1])
+    scale = calculate._number_format_scale(format) or 0
+
+    magnitude = rng.choice([1.0, 1e4, 1e9])
+    values = rng.uniform(-magnitude, magnitude, n_rows)
+    if dtype.startswith("int"):
+        values = np.rint(values)
+    else:
+        # Show every digit: exact_fixed_point rounds values to their format
+        values = np.round(values, scale)
+        values[rng.random(n_rows) < 0.01] = rng.choice([np.inf, -np.inf])
+        values[rng.random(n_rows) < rng.choice(NullFractions)] = np.nan
+    values[rng.random(n_rows) < 0.05] = 0
+
+    if type == "text":
+        # Numbers as people type them, some not numbers at all
+        text = [
+            None if np.isnan(value) else rng.choice(TextNumberFormats).format(value)
+            for value in values
+        ]
+        for i in np.flatnonzero(rng.random(n_rows) < 0.02):
+            text[i] = rng.choice(["n/a", "", "1.2.3"])
+        return pd.Series(text, dtype="str"), None
+
+    return values.astype(dtype), format
+
+
+def _random_keys(rng: np.random.Generator, n_rows: int) -> pd.Series:
+    keys = [Keys[i] for i in rng.integers(0, len(Keys), n_rows)]
+    return pd.Series(keys, dtype="str")
+
+
+def random_case(
+    rng: np.random.Generator,
+    operation: str,
+    single_value_selector: str,
+    *,
+    n_rows: int,
+    max_columns: int = 5,
+) -> Case:
+    """
+    Return a random table and params for `operation` and `single_value_selector`.
+    """
+    n_rows = int(rng.choice([0, 1, 7, n_rows]))
+    n_columns = int(rng.integers(1, max_columns + 1))
+    case_type = rng.choice(ColumnTypes)
+    data = {}
+    input_columns = {}
+    for i in range(n_columns):
+        name = f"c{i}"
+        type = "number" if case_type == "text" and rng.random() < 0.5 else case_type
+        data[name], format = _random_column(rng, n_rows, type)
+        input_columns[name] = Column(name, type, format)
+    names = list(input_columns.keys())
+    for name in ["key", "row_key"]:
+        data[name] = _random_keys(rng, n_rows)
+        input_columns[name] = Column(name, "text", None)
+    table = pd.DataFrame(data)
+
+    n_colnames = int(rng.integers(0, n_columns + 1)) if rng.random() < 0.1 else 0
+    params = default_params(
+        operation=operation,
+        colnames=list(rng.choice(names, n_colnames or n_columns, replace=False)),
+        col1=str(rng.choice(names)),
+        col2=str(rng.choice(names)),
+        single_value_selector=single_value_selector,
+        single_value_col=str(rng.choice(names)),
+        single_value_row=int(rng.integers(0, n_rows + 2)),
+        single_value_constant=float(rng.choice(Constants)),
+        outcolname=str(rng.choice(["", "out"])),
+        null_policy=str(rng.choice(NullPolicies)),
+        null_min_count=int(rng.integers(0, 4)),
+        parse_text_numbers=bool(rng.random() < 0.9),
+        single_value_key_col="key",
+        single_value_key=str(rng.choice(Keys[:-1] + ["missing"])),
+        single_value_row_key_col="row_key",
+    )
+    return Case(f"{operation}/{single_value_selector}", table, params, input_columns)
+
+
+def generate_cases(
+    *, seed: int = 0, n_cases: int = 3, n_rows: int = 100
+) -> Iterator[Case]:
+    """
+    Yield `n_cases` random cases for each operation and single_value_selector.
+    """
+    rng = np.random.default_rng(seed)
+    for operation in calculate.Operations:
+        for single_value_selector in SingleValueSelectors:
+            for i in range(n_cases):
+                case = random_case(rng, operation, single_value_selector, n_rows=n_rows)
+                yield case._replace(name=f"{case.name}#{i}")
+
+
+def _compare_series(
+    expected: pd.Series,
+    actual: pd.Series,
+    rtol: float,
+    atol: float,
+    check_dtype: bool,
+) -> Optional[str]:
+    if (check_dtype or expected.dtype.kind not in "fiu") and (
+        expected.dtype != actual.dtype
+    ):
+        return f"{expected.name}: dtype {expected.dtype} != {actual.dtype}"
+    if expected.dtype.kind not in "fiu":
+        if not expected.equals(actual):
+            return f"{expected.name}: values differ"
+        return None
+    e = expected.to_numpy(dtype=np.float64, na_value=np.nan)
+    a = actual.to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid="ignore"):
+        close = np.isclose(e, a, rtol=rtol, atol=atol, equal_nan=True)
+    if not close.all():
+        row = int(np.argmin(close))
+        return f"{expected.name}[{row}]: {float(e[row])!r} != {float(a[row])!r}"
+    return None
+
+
+def compare_results(
+    expected: Any,
+    actual: Any,
+    *,
+    rtol: float = DefaultRtol,
+    atol: float = DefaultAtol,
+    check_dtype: bool = False,
+) -> Optional[str]:
+    """
+    Return how `actual` differs from `expected` (render results), or None.
+
+    Numbers match if they are within tolerance, or both NaN, or the same inf.
+    Workbench shows every numeric dtype as "number", so int64 and float64
+    columns with the same values match unless `check_dtype`. Everything else
+    (errors, formats and column names) must be equal.
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in ["errors", "column_formats"]:
+            if expected[key] != actual[key]:
+                return f"{key}: {expected[key]!r} != {actual[key]!r}"
+        return compare_results(
+            expected["dataframe"],
+            actual["dataframe"],
+            rtol=rtol,
+            atol=atol,
+            check_dtype=check_dtype,
+        )
+    elif isinstance(expected, pd.DataFrame) and isinstance(actual, pd.DataFrame):
+        if list(expected.columns) != list(actual.columns):
+            return f"columns: {list(expected.columns)} != {list(actual.columns)}"
+        for name in expected.columns:
+            mismatch = _compare_series(
+                expected[name], actual[name], rtol, atol, check_dtype
+            )
+            if mismatch is not None:
+                return mismatch
+        return None
+    elif type(expected) != type(actual):
+        return f"{type(expected).__name__} != {type(actual).__name__}"
+    elif expected != actual:
+        return f"{expected!r} != {actual!r}"
+    else:
+        return None
+
+
+def _case_tolerance(case: Case, rtol: float, atol: float) -> Tuple[float, float]:
+    """
+    Loosen `rtol` and `atol` to the precision of the case's input columns.
+
+    Engines may compute float32 inputs in float64, or in a different order:
+    results can differ by float32 rounding error, relative to the inputs.
+    """
+    for column in case.table.columns:
+        values = case.table[column]
+        if values.dtype.kind == "f" and np.finfo(values.dtype).eps > rtol:
+            eps = 4 * float(np.finfo(values.dtype).eps)
+            finite = values[np.isfinite(values)]
+            magnitude = float(finite.abs().max()) if len(finite) else 0.0
+            rtol = max(rtol, eps)
+            atol = max(atol, eps * magnitude)
+    return rtol, atol
+
+
+def _timed(engine: Engine, case: Case, repeat: int):
+    seconds = math.inf
+    for _ in range(repeat):
+        table = case.table.copy()  # render() adds a column to the table
+        start = time.perf_counter()
+        with np.errstate(all="ignore"):  # inf and NaN are part of the test
+            result = engine(table, case.params, case.input_columns)
+        seconds = min(seconds, time.perf_counter() - start)
+    return result, seconds
+
+
+def run_differential(
+    engines: Dict[str, Engine],
+    cases: Iterator[Case],
+    *,
+    reference: Engine = render_reference,
+    repeat: int = 1,
+    rtol: float = DefaultRtol,
+    atol: float = DefaultAtol,
+) -> Iterator[CaseResult]:
+    """
+    Render each case with `reference` and each engine; yield comparisons.
+
+    An engine that raises where the reference doesn't is a mismatch. Cases
+    with float32 inputs are compared at float32 precision.
+    """
+    for case in cases:
+        expected, reference_seconds = _timed(reference, case, repeat)
+        for name, engine in engines.items():
+            try:
+                actual, engine_seconds = _timed(engine, case, repeat)
+            except Exception as err:
+                mismatch, engine_seconds = f"raised {err!r}", math.inf
+            else:
+                case_rtol, case_atol = _case_tolerance(case, rtol, atol)
+                mismatch = compare_results(
+                    expected, actual, rtol=case_rtol, atol=case_atol
+                )
+            yield CaseResult(case, name, mismatch, reference_seconds, engine_seconds)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", type=int, default=3, help="per operation+mode")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("engines", nargs="*", choices=[[], *Engines.keys()])
+    args = parser.parse_args(argv)
+
+    engines = {name: Engines[name] for name in args.engines or Engines.keys()}
+    cases = generate_cases(seed=args.seed, n_cases=args.cases, n_rows=args.rows)
+    n_mismatches = 0
+    log_speedups = {name: [] for name in engines}
+    for result in run_differential(engines, cases, repeat=args.repeat):
+        status = "ok" if result.mismatch is None else f"MISMATCH {result.mismatch}"
+        print(
+            f"{result.case.name} {result.engine}: {result.speedup:.2f}x "
+            f"({len(result.case.table)} rows) {status}"
+        )
+        if result.mismatch is None:
+            log_speedups[result.engine].append(math.log(result.speedup))
+        else:
+            n_mismatches += 1
+
+    for name, logs in log_speedups.items():
+        if logs:
+            print(f"# {name}: geometric mean speedup {math.exp(np.mean(logs)):.2f}x")
+    print(f"# {n_mismatches} mismatches")
+    return 1 if n_mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
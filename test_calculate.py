@@ -1,11 +1,20 @@
+import math
+import os
+import py_compile
+import subprocess
+import sys
 import unittest
-from typing import NamedTuple, Optional
+import warnings
+from typing import Dict, NamedTuple, Optional
+from unittest.mock import patch
 
 import calculate
+import differential_calculate
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from cjwmodule.testing.i18n import cjwmodule_i18n_message, i18n_message
-from pandas.api.types import is_numeric_dtype
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
 from pandas.testing import assert_frame_equal
 
 DefaultParams = {
@@ -18,6 +27,15 @@ DefaultParams = {
     "single_value_row": 1,
     "single_value_constant": 1.0,
     "outcolname": "",
+    "exact_fixed_point": False,
+    "accurate_sum": False,
+    "null_policy": "default",
+    "null_min_count": 1,
+    "parse_text_numbers": False,
+    "duration_unit": "days",
+    "single_value_key_col": "",
+    "single_value_key": "",
+    "single_value_row_key_col": "",
 }
 
 
@@ -38,7 +56,9 @@ class Settings(NamedTuple):
     MAX_BYTES_PER_COLUMN_NAME: int = 120
 
 
-def render(table, params, *, settings=Settings(), input_columns=None):
+def render(
+    table, params, *, settings=Settings(), input_columns=None, result_only=False
+):
     """
     calculate.render() helper that automatically adds input_columns to
     arguments if they aren't specified..
@@ -50,16 +70,150 @@ def render(table, params, *, settings=Settings(), input_columns=None):
         def _infer_input_column(series: pd.Series) -> Column:
             if is_numeric_dtype(series):
                 return Column(series.name, "number", "{:,}")
+            elif is_datetime64_any_dtype(series):
+                return Column(series.name, "timestamp", None)
             else:
                 return Column(series.name, "text", None)
 
         input_columns = {c: _infer_input_column(table[c]) for c in table.columns}
 
     return calculate.render(
-        table, params, settings=settings, input_columns=input_columns
+        table,
+        params,
+        settings=settings,
+        input_columns=input_columns,
+        result_only=result_only,
     )
 
 
+ImportTimeBudgetMicroseconds = 5000
+"""How long `import calculate` may take, so `migrate_params()` starts quickly."""
+
+
+def import_times(code: str) -> Dict[str, int]:
+    """
+    Run `code` in a fresh interpreter; return cumulative import time per module.
+
+    Parses `python -X importtime` output ("import time: self | cumulative | name").
+    """
+    # Measure importing, not compiling (PYTHONDONTWRITEBYTECODE may be set)
+    py_compile.compile(calculate.__file__)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+PeakRssScript = """
+import ctypes, sys
+import numpy as np, pandas as pd
+import calculate
+from test_calculate import P, Column, Settings
+
+def status(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) * 1024
+
+operation, n_rows, n_columns, budget, text = sys.argv[1:]
+rng = np.random.default_rng(0)
+table = pd.DataFrame(
+    {f"c{i}": rng.uniform(-1, 1, int(n_rows)) for i in range(int(n_columns))}
+)
+table.iloc[::3, 0] = np.nan
+if text == "text":
+    table = table.apply(
+        lambda column: column.map("${:,.2f}".format, na_action="ignore")
+    )
+    input_columns = {c: Column(c, "text", None) for c in table.columns}
+    ctypes.CDLL("libc.so.6").malloc_trim(0)  # so RSS can't reuse the formatting's
+else:
+    input_columns = {c: Column(c, "number", "{:,.2f}") for c in table.columns}
+params = P(
+    operation=operation,
+    colnames=list(table.columns),
+    col1="c0",
+    col2="c1",
+    parse_text_numbers=text == "text",
+)
+calculate.MemoryBudget = int(budget)
+# Warm up: import and allocate everything we don't want to measure
+settings = Settings()
+calculate.render(
+    table.head(10).copy(), params, input_columns=input_columns, settings=settings
+)
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")  # reset VmHWM, the peak RSS
+before = status("VmRSS")
+calculate.render(table, params, input_columns=input_columns, settings=settings)
+print(calculate.plan_execution(table, params).strategy, status("VmHWM") - before)
+"""
+
+
+def peak_rss(
+    operation: str, n_rows: int, n_columns: int, budget: int, text: bool = False
+):
+    """
+    Render a random table in a fresh interpreter; return (strategy, peak bytes).
+
+    "Peak bytes" is how far RSS grew beyond the input table (Linux only). If
+    `text`, the table holds text like "$1,234.56" and we parse it.
+    """
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            PeakRssScript,
+            operation,
+            str(n_rows),
+            str(n_columns),
+            str(budget),
+            "text" if text else "number",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    strategy, peak = completed.stdout.split()
+    return strategy, int(peak)
+
+
+class ImportTimeTest(unittest.TestCase):
+    Code = (
+        "import sys, calculate; "
+        "calculate.migrate_params({'operation': 5, 'colnames': 'A,B', 'col1': '', "
+        "'col2': '', 'single_value_selector': 2, 'single_value_col': '', "
+        "'single_value_row': 1, 'single_value_constant': 1.0}); "
+        "assert 'Operations' not in vars(calculate)"
+    )
+
+    def test_migrate_params_does_not_import_heavy_modules(self):
+        times = import_times(self.Code)
+        for module in ["pandas", "numpy", "cjwmodule", "dataclasses", "inspect"]:
+            self.assertNotIn(module, times)
+
+    def test_import_time_budget(self):
+        # Best of 3: the first run may write bytecode, and CI machines are noisy
+        best = min(import_times(self.Code)["calculate"] for _ in range(3))
+        self.assertLess(best, ImportTimeBudgetMicroseconds)
+
+    def test_operations_is_built_on_demand(self):
+        self.assertIn("add", calculate.Operations)
+        self.assertIs(calculate.Operations, calculate._operations())
+
+
 class MigrateParamsTest(unittest.TestCase):
     def test_v0(self):
         self.assertEqual(
@@ -94,6 +248,15 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
@@ -122,6 +285,15 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
@@ -150,6 +322,15 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
@@ -178,6 +359,15 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
@@ -206,6 +396,15 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
@@ -234,9 +433,231 @@ class MigrateParamsTest(unittest.TestCase):
                 "single_value_row": 1,
                 "single_value_constant": 1.0,
                 "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
+            },
+        )
+
+    def test_v4(self):
+        self.assertEqual(
+            calculate.migrate_params(
+                {
+                    "operation": "add",
+                    "colnames": ["A", "B"],
+                    "col1": "",
+                    "col2": "",
+                    "single_value_selector": "none",
+                    "single_value_col": "",
+                    "single_value_row": 1,
+                    "single_value_constant": 1.0,
+                    "outcolname": "",
+                    "exact_fixed_point": True,
+                }
+            ),
+            {
+                "operation": "add",
+                "colnames": ["A", "B"],
+                "col1": "",
+                "col2": "",
+                "single_value_selector": "none",
+                "single_value_col": "",
+                "single_value_row": 1,
+                "single_value_constant": 1.0,
+                "outcolname": "",
+                "exact_fixed_point": True,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
+            },
+        )
+
+    def test_v5(self):
+        self.assertEqual(
+            calculate.migrate_params(
+                {
+                    "operation": "add",
+                    "colnames": ["A", "B"],
+                    "col1": "",
+                    "col2": "",
+                    "single_value_selector": "none",
+                    "single_value_col": "",
+                    "single_value_row": 1,
+                    "single_value_constant": 1.0,
+                    "outcolname": "",
+                    "exact_fixed_point": False,
+                    "accurate_sum": True,
+                }
+            ),
+            {
+                "operation": "add",
+                "colnames": ["A", "B"],
+                "col1": "",
+                "col2": "",
+                "single_value_selector": "none",
+                "single_value_col": "",
+                "single_value_row": 1,
+                "single_value_constant": 1.0,
+                "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": True,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
+            },
+        )
+
+    def test_v6(self):
+        self.assertEqual(
+            calculate.migrate_params(
+                {
+                    "operation": "add",
+                    "colnames": ["A", "B"],
+                    "col1": "",
+                    "col2": "",
+                    "single_value_selector": "none",
+                    "single_value_col": "",
+                    "single_value_row": 1,
+                    "single_value_constant": 1.0,
+                    "outcolname": "",
+                    "exact_fixed_point": False,
+                    "accurate_sum": False,
+                    "null_policy": "min_count",
+                    "null_min_count": 2,
+                }
+            ),
+            {
+                "operation": "add",
+                "colnames": ["A", "B"],
+                "col1": "",
+                "col2": "",
+                "single_value_selector": "none",
+                "single_value_col": "",
+                "single_value_row": 1,
+                "single_value_constant": 1.0,
+                "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "min_count",
+                "null_min_count": 2,
+                "parse_text_numbers": False,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
+            },
+        )
+
+    def test_v7(self):
+        self.assertEqual(
+            calculate.migrate_params(
+                {
+                    "operation": "add",
+                    "colnames": ["A", "B"],
+                    "col1": "",
+                    "col2": "",
+                    "single_value_selector": "none",
+                    "single_value_col": "",
+                    "single_value_row": 1,
+                    "single_value_constant": 1.0,
+                    "outcolname": "",
+                    "exact_fixed_point": False,
+                    "accurate_sum": False,
+                    "null_policy": "default",
+                    "null_min_count": 1,
+                    "parse_text_numbers": True,
+                }
+            ),
+            {
+                "operation": "add",
+                "colnames": ["A", "B"],
+                "col1": "",
+                "col2": "",
+                "single_value_selector": "none",
+                "single_value_col": "",
+                "single_value_row": 1,
+                "single_value_constant": 1.0,
+                "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": True,
+                "duration_unit": "days",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
+            },
+        )
+
+    def test_v8(self):
+        self.assertEqual(
+            calculate.migrate_params(
+                {
+                    "operation": "subtract",
+                    "colnames": [],
+                    "col1": "A",
+                    "col2": "B",
+                    "single_value_selector": "none",
+                    "single_value_col": "",
+                    "single_value_row": 1,
+                    "single_value_constant": 1.0,
+                    "outcolname": "",
+                    "exact_fixed_point": False,
+                    "accurate_sum": False,
+                    "null_policy": "default",
+                    "null_min_count": 1,
+                    "parse_text_numbers": False,
+                    "duration_unit": "hours",
+                }
+            ),
+            {
+                "operation": "subtract",
+                "colnames": [],
+                "col1": "A",
+                "col2": "B",
+                "single_value_selector": "none",
+                "single_value_col": "",
+                "single_value_row": 1,
+                "single_value_constant": 1.0,
+                "outcolname": "",
+                "exact_fixed_point": False,
+                "accurate_sum": False,
+                "null_policy": "default",
+                "null_min_count": 1,
+                "parse_text_numbers": False,
+                "duration_unit": "hours",
+                "single_value_key_col": "",
+                "single_value_key": "",
+                "single_value_row_key_col": "",
             },
         )
 
+    def test_v9(self):
+        params = {
+            **calculate.migrate_params(DefaultParams),
+            "single_value_selector": "lookup",
+            "single_value_col": "Value",
+            "single_value_key_col": "Name",
+            "single_value_key": "Total",
+        }
+        self.assertEqual(calculate.migrate_params(params), params)
+
 
 class RenderTest(unittest.TestCase):
     def setUp(self):
@@ -652,6 +1073,1248 @@ class RenderTest(unittest.TestCase):
             ],
         )
 
+    def test_append_copies_no_other_column(self):
+        # 200 single-column blocks, as a host may build a wide table
+        table = pa.table({f"c{i}": [1.0, 2.0] for i in range(200)}).to_pandas(
+            split_blocks=True
+        )
+        c5 = table["c5"].to_numpy()
+        with patch.object(
+            calculate, "_IgnoringFragmentationWarnings", False
+        ), warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")  # pandas warns when it's fragmented
+            result = render(table, P(operation="add", colnames=["c0", "c1"]))
+        self.assertEqual([str(w.message) for w in caught], [])
+        self.assertEqual(list(result["dataframe"]["Sum of c0, c1"]), [2.0, 4.0])
+        self.assertTrue(np.shares_memory(result["dataframe"]["c5"].to_numpy(), c5))
+
+    def test_result_only(self):
+        table = pd.DataFrame({"A": [1, 2], "B": [3.0, 4.0]})
+        result = render(
+            table,
+            P(operation="add", colnames=["A", "B"], outcolname="X"),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:,}"),
+            },
+            result_only=True,
+        )
+        assert_frame_equal(result["dataframe"], pd.DataFrame({"X": [4.0, 6.0]}))
+        self.assertEqual(result["column_formats"], {"X": "{:,.2f}"})
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(list(table.columns), ["A", "B"])  # untouched
+
+    def test_result_only_unique_name(self):
+        result = render(
+            pd.DataFrame({"A": [1], "B": [2], "Sum of A, B": [3]}),
+            P(operation="add", colnames=["A", "B"]),
+            result_only=True,
+        )
+        self.assertEqual(list(result["dataframe"].columns), ["Sum of A, B 2"])
+        self.assertEqual(result["column_formats"], {"Sum of A, B 2": "{:,}"})
+
+    def test_result_only_no_op(self):
+        result = render(self.table, P(operation="add", colnames=[]), result_only=True)
+        assert_frame_equal(result, pd.DataFrame(index=self.table.index))
+
+    def test_result_only_error(self):
+        result = render(
+            pd.DataFrame({"a": [-1, 1]}),
+            P(operation="percent_of_column_sum", col1="a"),
+            result_only=True,
+        )
+        self.assertEqual(
+            result, i18n_message("badData.percent_of_column_sum.sumIsZero")
+        )
+
+
+class ExactFixedPointTest(unittest.TestCase):
+    def test_add_exact(self):
+        result = render(
+            pd.DataFrame({"A": [0.1, 1.1, np.nan], "B": [0.2, 2.2, np.nan]}),
+            P(operation="add", colnames=["A", "B"], exact_fixed_point=True),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:,.2f}"),
+            },
+        )
+        # float path gives 0.30000000000000004 and 3.3000000000000003
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [0.3, 3.3, 0.0])
+        self.assertEqual(result["column_formats"], {"Sum of A, B": "{:,.2f}"})
+
+    def test_add_exact_rounds_to_format(self):
+        result = render(
+            pd.DataFrame({"A": [1.004], "B": [2.0]}),
+            P(operation="add", colnames=["A", "B"], exact_fixed_point=True),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "${:,.1f}"),
+            },
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [3.0])
+
+    def test_add_exact_constant(self):
+        result = render(
+            pd.DataFrame({"A": [0.1], "B": [0.2]}),
+            P(
+                operation="add",
+                colnames=["A", "B"],
+                single_value_selector="constant",
+                single_value_constant=0.005,
+                exact_fixed_point=True,
+            ),
+            input_columns={
+                "A": Column("A", "number", "{:,.1f}"),
+                "B": Column("B", "number", "{:,.1f}"),
+            },
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [0.305])
+
+    def test_add_exact_cell_rounds_to_its_format(self):
+        for selector in ["cell", "lookup"]:
+            with self.subTest(selector=selector):
+                result = render(
+                    pd.DataFrame(
+                        {"A": [0.1], "B": [0.2], "C": [0.1 + 0.2], "K": ["x"]}
+                    ),
+                    P(
+                        operation="add",
+                        colnames=["A", "B"],
+                        single_value_selector=selector,
+                        single_value_col="C",
+                        single_value_row=1,
+                        single_value_key_col="K",
+                        single_value_key="x",
+                        exact_fixed_point=True,
+                    ),
+                    input_columns={
+                        "A": Column("A", "number", "{:,.2f}"),
+                        "B": Column("B", "number", "{:,.2f}"),
+                        "C": Column("C", "number", "{:,.2f}"),
+                        "K": Column("K", "text", None),
+                    },
+                )
+                # drifted C = 0.30000000000000004 would fall back to floats
+                self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [0.6])
+
+    def test_multiply_exact(self):
+        result = render(
+            pd.DataFrame({"A": [1.1, 2.0], "B": [1.1, np.nan]}),
+            P(
+                operation="multiply",
+                colnames=["A", "B"],
+                single_value_selector="constant",
+                single_value_constant=3.0,
+                exact_fixed_point=True,
+            ),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:.1%}"),
+            },
+        )
+        # float path gives 3.630000000000001
+        self.assertEqual(list(result["dataframe"]["Product of A, B"]), [3.63, 6.0])
+
+    def test_subtract_exact(self):
+        result = render(
+            pd.DataFrame({"A": [0.3, 1.0], "B": [0.1, np.nan]}),
+            P(operation="subtract", col1="A", col2="B", exact_fixed_point=True),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:,.2f}"),
+            },
+        )
+        # float path gives 0.19999999999999998
+        assert_frame_equal(
+            result["dataframe"],
+            pd.DataFrame(
+                {"A": [0.3, 1.0], "B": [0.1, np.nan], "A minus B": [0.2, np.nan]}
+            ),
+        )
+
+    def test_exact_fallback_when_format_has_no_decimal_places(self):
+        result = render(
+            pd.DataFrame({"A": [0.1], "B": [0.2]}),
+            P(operation="add", colnames=["A", "B"], exact_fixed_point=True),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:,}"),
+            },
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [0.1 + 0.2])
+
+    def test_exact_fallback_when_too_big(self):
+        result = render(
+            pd.DataFrame({"A": [1e20], "B": [1.0]}),
+            P(operation="add", colnames=["A", "B"], exact_fixed_point=True),
+            input_columns={
+                "A": Column("A", "number", "{:,.2f}"),
+                "B": Column("B", "number", "{:,.2f}"),
+            },
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [1e20 + 1.0])
+
+    def test_number_format_scale(self):
+        self.assertEqual(calculate._number_format_scale("{:,.2f}"), 2)
+        self.assertEqual(calculate._number_format_scale("${:,.0f}"), 0)
+        self.assertEqual(calculate._number_format_scale("{:,.1%}"), 3)
+        self.assertEqual(calculate._number_format_scale("{:,d}"), 0)
+        self.assertIsNone(calculate._number_format_scale("{:,}"))
+        self.assertIsNone(calculate._number_format_scale(None))
+
+
+class AccurateSumTest(unittest.TestCase):
+    def test_add_accurate(self):
+        table = pd.DataFrame(
+            {"A": [1e16, 1.0, np.nan], "B": [1.0, 2.0, np.nan], "C": [-1e16, 3, np.nan]}
+        )
+        result = render(table.copy(), P(operation="add", colnames=["A", "B", "C"]))
+        self.assertEqual(list(result["dataframe"]["Sum of A, B, C"]), [0.0, 6.0, 0.0])
+        result = render(
+            table.copy(),
+            P(operation="add", colnames=["A", "B", "C"], accurate_sum=True),
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B, C"]), [1.0, 6.0, 0.0])
+
+    def test_add_accurate_integers_stay_exact(self):
+        table = pd.DataFrame({"A": [2 ** 60 + 1], "B": [1]})
+        params = P(operation="add", colnames=["A", "B"])
+        default = render(table.copy(), params)
+        accurate = render(table.copy(), {**params, "accurate_sum": True})
+        assert_frame_equal(accurate["dataframe"], default["dataframe"])
+        self.assertEqual(list(accurate["dataframe"]["Sum of A, B"]), [2 ** 60 + 2])
+
+    def test_add_accurate_constant(self):
+        result = render(
+            pd.DataFrame({"A": [1e16], "B": [1.0]}),
+            P(
+                operation="add",
+                colnames=["A", "B"],
+                single_value_selector="constant",
+                single_value_constant=-1e16,
+                accurate_sum=True,
+            ),
+        )
+        self.assertEqual(list(result["dataframe"]["Sum of A, B"]), [1.0])
+
+    def test_add_accurate_inf(self):
+        result = render(
+            pd.DataFrame({"A": [np.inf, np.inf], "B": [1.0, -np.inf]}),
+            P(operation="add", colnames=["A", "B"], accurate_sum=True),
+        )
+        assert_frame_equal(
+            result["dataframe"],
+            pd.DataFrame(
+                {
+                    "A": [np.inf, np.inf],
+                    "B": [1.0, -np.inf],
+                    "Sum of A, B": [np.inf, np.nan],
+                }
+            ),
+        )
+
+    def test_mean_accurate(self):
+        result = render(
+            pd.DataFrame(
+                {"A": [1e16, np.nan], "B": [3.0, np.nan], "C": [-1e16, np.nan]}
+            ),
+            P(operation="mean", colnames=["A", "B", "C"], accurate_sum=True),
+        )
+        assert_frame_equal(
+            result["dataframe"],
+            pd.DataFrame(
+                {
+                    "A": [1e16, np.nan],
+                    "B": [3.0, np.nan],
+                    "C": [-1e16, np.nan],
+                    "Average of A, B, C": [1.0, np.nan],
+                }
+            ),
+        )
+
+    def test_percent_of_column_sum_accurate(self):
+        result = render(
+            pd.DataFrame({"A": [1e16, 2.0, -1e16, np.nan]}),
+            P(operation="percent_of_column_sum", col1="A", accurate_sum=True),
+        )
+        self.assertEqual(
+            list(result["dataframe"]["Percent of A"].fillna(-1)), [5e15, 1, -5e15, -1]
+        )
+
+    def test_percent_of_column_sum_accurate_sum_is_zero(self):
+        result = render(
+            pd.DataFrame({"A": [1e16, -1e16]}),
+            P(operation="percent_of_column_sum", col1="A", accurate_sum=True),
+        )
+        self.assertEqual(
+            result, i18n_message("badData.percent_of_column_sum.sumIsZero")
+        )
+
+    def test_compensated_sum_many_values(self):
+        rng = np.random.default_rng(0)
+        values = rng.standard_normal(10_000) * 10.0 ** rng.integers(-8, 8, 10_000)
+        exact = math.fsum(values)
+        naive_error = abs(values.sum() - exact)
+        error = abs(calculate._compensated_sum(pd.Series(values)) - exact)
+        self.assertLessEqual(error, abs(exact) * 1e-15)
+        self.assertLessEqual(error, naive_error)
+
+
+class NullPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.table = pd.DataFrame(
+            {"A": [1.0, np.nan, np.nan], "B": [2.0, 3.0, np.nan], "C": [3.0, 4.0, 5.0]}
+        )
+
+    def _result(self, params):
+        result = render(self.table.copy(), P(outcolname="X", **params))
+        return list(result["dataframe"]["X"].fillna(-1))
+
+    def test_multicolumn_skip(self):
+        for policy in ["default", "skip"]:
+            self.assertEqual(
+                self._result(
+                    dict(operation="add", colnames=["A", "B", "C"], null_policy=policy)
+                ),
+                [6.0, 7.0, 5.0],
+            )
+
+    def test_multicolumn_propagate(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="add", colnames=["A", "B", "C"], null_policy="propagate")
+            ),
+            [6.0, -1, -1],
+        )
+
+    def test_multicolumn_zero(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="mean", colnames=["A", "B", "C"], null_policy="zero")
+            ),
+            [2.0, 7.0 / 3, 5.0 / 3],
+        )
+
+    def test_multicolumn_min_count(self):
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="maximum",
+                    colnames=["A", "B", "C"],
+                    null_policy="min_count",
+                    null_min_count=2,
+                )
+            ),
+            [3.0, 4.0, -1],
+        )
+
+    def test_multicolumn_propagate_with_constant(self):
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="multiply",
+                    colnames=["A", "B"],
+                    single_value_selector="constant",
+                    single_value_constant=2.0,
+                    null_policy="propagate",
+                )
+            ),
+            [4.0, -1, -1],
+        )
+
+    def test_binary_zero(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="subtract", col1="C", col2="A", null_policy="zero")
+            ),
+            [2.0, 4.0, 5.0],
+        )
+
+    def test_binary_zero_divide_is_null(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="divide", col1="C", col2="A", null_policy="zero")
+            ),
+            [3.0, -1, -1],
+        )
+
+    def test_binary_skip_propagates(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="subtract", col1="C", col2="B", null_policy="skip")
+            ),
+            [1.0, 1.0, -1],
+        )
+
+    def test_binary_min_count(self):
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="subtract",
+                    col1="C",
+                    col2="B",
+                    null_policy="min_count",
+                    null_min_count=3,
+                )
+            ),
+            [-1, -1, -1],
+        )
+
+    def test_unary_propagate(self):
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="percent_of_column_sum", col1="B", null_policy="propagate"
+                )
+            ),
+            [-1, -1, -1],
+        )
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="percent_of_column_sum", col1="C", null_policy="propagate"
+                )
+            ),
+            [0.25, 1 / 3, 5 / 12],
+        )
+
+    def test_unary_zero(self):
+        self.assertEqual(
+            self._result(
+                dict(operation="percent_of_column_sum", col1="B", null_policy="zero")
+            ),
+            [0.4, 0.6, 0.0],
+        )
+
+    def test_unary_min_count(self):
+        self.assertEqual(
+            self._result(
+                dict(
+                    operation="percent_of_column_sum",
+                    col1="A",
+                    null_policy="min_count",
+                    null_min_count=2,
+                )
+            ),
+            [-1, -1, -1],
+        )
+
+
+class SparseTest(unittest.TestCase):
+    def setUp(self):
+        # 2% of rows have values: sparse enough to compute just those rows
+        self.table = pd.DataFrame(
+            {
+                "A": [1.0, np.nan, 5.0] + [np.nan] * 97,
+                "B": [2.0, 3.0, np.nan] + [np.nan] * 97,
+                "C": [np.nan, 4.0, 6.0] + [np.nan] * 97,
+            }
+        )
+
+    def _render(self, threshold, **kwargs):
+        with patch.object(calculate, "SparseDensityThreshold", threshold), patch.object(
+            calculate, "BinarySparseDensityThreshold", threshold
+        ):
+            return render(self.table.copy(), P(outcolname="X", **kwargs))
+
+    def _assert_same_as_dense(self, **kwargs):
+        sparse_result = self._render(0.1, **kwargs)
+        dense_result = self._render(-1, **kwargs)
+        assert_frame_equal(
+            sparse_result["dataframe"], dense_result["dataframe"], check_dtype=False
+        )
+        return list(sparse_result["dataframe"]["X"][:4].fillna(-1))
+
+    def test_sparse_positions(self):
+        masks = calculate._validity_masks(self.table, ["A", "B"])
+        self.assertEqual(
+            list(
+                calculate._sparse_row_positions(masks, need_all=False, threshold=0.1)
+            ),
+            [0, 1, 2],
+        )
+        self.assertEqual(
+            list(calculate._sparse_row_positions(masks, need_all=True, threshold=0.1)),
+            [0],
+        )
+
+    def test_dense_positions(self):
+        masks = calculate._validity_masks(self.table, ["A", "B"])
+        self.assertIsNone(
+            calculate._sparse_row_positions(masks, need_all=False, threshold=0.01)
+        )
+
+    def test_sum(self):
+        self.assertEqual(
+            self._assert_same_as_dense(operation="add", colnames=["A", "B", "C"]),
+            [3.0, 7.0, 11.0, 0.0],
+        )
+
+    def test_sum_constant_fills_empty_rows(self):
+        self.assertEqual(
+            self._assert_same_as_dense(
+                operation="add",
+                colnames=["A", "B"],
+                single_value_selector="constant",
+                single_value_constant=10.0,
+            ),
+            [13.0, 13.0, 15.0, 10.0],
+        )
+
+    def test_mean(self):
+        self.assertEqual(
+            self._assert_same_as_dense(operation="mean", colnames=["A", "B", "C"]),
+            [1.5, 3.5, 5.5, -1],
+        )
+
+    def test_propagate(self):
+        self.assertEqual(
+            self._assert_same_as_dense(
+                operation="add", colnames=["A", "B"], null_policy="propagate"
+            ),
+            [3.0, -1, -1, -1],
+        )
+
+    def test_subtract(self):
+        self.assertEqual(
+            self._assert_same_as_dense(operation="subtract", col1="C", col2="A"),
+            [-1, -1, 1.0, -1],
+        )
+
+    def test_percent_multiply(self):
+        self.assertEqual(
+            self._assert_same_as_dense(
+                operation="percent_multiply", col1="C", col2="A"
+            ),
+            [-1, -1, 0.3, -1],
+        )
+
+
+class ParseTextNumbersTest(unittest.TestCase):
+    def test_parse(self):
+        values, n_invalid, all_percent = calculate._parse_text_numbers(
+            pd.Series(
+                [
+                    "1,234.5",
+                    " -$6 ",
+                    "$-6",
+                    "€7",
+                    "+8e3",
+                    ".5",
+                    "9%",
+                    "1,234,567",
+                    None,
+                    "",
+                    "  ",
+                ]
+            )
+        )
+        np.testing.assert_array_equal(
+            values,
+            [1234.5, -6, -6, 7, 8000, 0.5, 0.09, 1234567] + [np.nan] * 3,
+        )
+        self.assertEqual(n_invalid, 0)
+        self.assertFalse(all_percent)
+
+    def test_parse_invalid(self):
+        values, n_invalid, _ = calculate._parse_text_numbers(
+            pd.Series(["1,23", "12,34,567", "1.2.3", "--1", "$", "x1", "nan", "3"])
+        )
+        np.testing.assert_array_equal(values, [np.nan] * 7 + [3.0])
+        self.assertEqual(n_invalid, 7)
+
+    def test_parse_object_dtype(self):
+        values, n_invalid, all_percent = calculate._parse_text_numbers(
+            pd.Series(["50%", None, " 2.5 % "], dtype=object)
+        )
+        np.testing.assert_array_equal(values, [0.5, np.nan, 0.025])
+        self.assertEqual(n_invalid, 0)
+        self.assertTrue(all_percent)
+
+    def test_add_text_columns(self):
+        table = pd.DataFrame({"A": ["1,000", "$2", None], "B": [1.0, 2.0, 3.0]})
+        result = render(
+            table.copy(),
+            P(colnames=["A", "B"], outcolname="X", parse_text_numbers=True),
+        )
+        assert_frame_equal(
+            result["dataframe"], table.assign(X=[1001.0, 4.0, 3.0])  # A is text
+        )
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(result["column_formats"], {"X": "{:,}"})
+
+    def test_text_columns_need_opt_in(self):
+        result = render(
+            pd.DataFrame({"A": ["1"], "B": [1.0]}),
+            P(operation="subtract", col1="B", col2="A"),
+        )
+        self.assertEqual(
+            result,
+            i18n_message("badParam.parse_text_numbers.textColumn", {"column": "A"}),
+        )
+
+    def test_invalid_cells_are_null_with_warning(self):
+        result = render(
+            pd.DataFrame({"A": ["1", "one", "two", ""], "B": ["2", "3", "4", "5"]}),
+            P(
+                operation="subtract",
+                col1="A",
+                col2="B",
+                outcolname="X",
+                parse_text_numbers=True,
+            ),
+        )
+        self.assertEqual(
+            list(result["dataframe"]["X"].fillna(-99)), [-1.0, -99, -99, -99]
+        )
+        self.assertEqual(
+            result["errors"],
+            [
+                i18n_message(
+                    "badData.parse_text_numbers.invalid", {"n": 2, "column": "A"}
+                )
+            ],
+        )
+
+    def test_percent_text_is_percent_format(self):
+        result = render(
+            pd.DataFrame({"A": ["50%", "10 %"], "B": [200.0, 30.0]}),
+            P(
+                operation="percent_multiply",
+                col1="A",
+                col2="B",
+                outcolname="X",
+                parse_text_numbers=True,
+            ),
+            input_columns={
+                "A": Column("A", "text", None),
+                "B": Column("B", "number", "{:,.2f}"),
+            },
+        )
+        self.assertEqual(list(result["dataframe"]["X"]), [100.0, 3.0])
+
+    def test_single_value_cell(self):
+        result = render(
+            pd.DataFrame({"A": [1.0, 2.0], "B": ["x", "$1,000"]}),
+            P(
+                colnames=["A"],
+                outcolname="X",
+                single_value_selector="cell",
+                single_value_col="B",
+                single_value_row=2,
+                parse_text_numbers=True,
+            ),
+        )
+        self.assertEqual(list(result["dataframe"]["X"]), [1001.0, 1002.0])
+
+    def test_parse_each_column_once(self):
+        table = pd.DataFrame({"A": [str(i) for i in range(5000)]})
+        with patch.object(calculate, "MemoryBudget", 0), patch.object(
+            calculate, "MinChunkRows", 1000
+        ), patch.object(
+            calculate, "_parse_text_numbers", wraps=calculate._parse_text_numbers
+        ) as parse:
+            result = render(
+                table,
+                P(
+                    operation="subtract",
+                    col1="A",
+                    col2="A",
+                    outcolname="X",
+                    parse_text_numbers=True,
+                ),
+            )
+        parse.assert_called_once()
+        self.assertEqual(result["dataframe"]["X"].sum(), 0.0)
+
+
+class TimestampTest(unittest.TestCase):
+    def setUp(self):
+        self.table = pd.DataFrame(
+            {
+                "A": pd.to_datetime(
+                    ["2020-01-02T00:00", "2020-03-01T12:00", None, "2020-01-01T00:00"]
+                ).as_unit("ns"),
+                "B": pd.to_datetime(
+                    ["2019-12-31T00:00", None, "2020-01-01T00:00", "2020-01-01T06:00"]
+                ).as_unit("ns"),
+            }
+        )
+
+    def _render(self, **kwargs):
+        return render(self.table.copy(), P(outcolname="X", **kwargs))
+
+    def test_subtract(self):
+        result = self._render(operation="subtract", col1="A", col2="B")
+        assert_frame_equal(
+            result["dataframe"],
+            self.table.assign(X=[2.0, np.nan, np.nan, -0.25]),
+        )
+        self.assertEqual(result["column_formats"], {"X": "{:,}"})
+
+    def test_subtract_units(self):
+        for unit, expected in [
+            ("seconds", 172800.0),
+            ("minutes", 2880.0),
+            ("hours", 48.0),
+            ("days", 2.0),
+            ("weeks", 2 / 7),
+        ]:
+            with self.subTest(unit=unit):
+                result = self._render(
+                    operation="subtract", col1="A", col2="B", duration_unit=unit
+                )
+                self.assertEqual(result["dataframe"]["X"][0], expected)
+
+    def test_subtract_exact_nanoseconds(self):
+        table = pd.DataFrame(
+            {
+                "A": [pd.Timestamp("2020-01-01") + pd.Timedelta(1, "ns")],
+                "B": [pd.Timestamp("2020-01-01")],
+            }
+        )
+        result = render(
+            table,
+            P(operation="subtract", col1="A", col2="B", duration_unit="seconds"),
+        )
+        self.assertEqual(result["dataframe"]["A minus B"][0], 1e-9)
+
+    def test_subtract_overflow_int64(self):
+        table = pd.DataFrame(
+            {
+                "A": pd.to_datetime(["2262-04-01"]).as_unit("ns"),
+                "B": pd.to_datetime(["1678-01-01"]).as_unit("ns"),
+            }
+        )
+        result = render(table, P(operation="subtract", col1="A", col2="B"))
+        self.assertEqual(result["dataframe"]["A minus B"][0], 213391.0)
+
+    def test_subtract_mixed_units_and_timezones(self):
+        table = pd.DataFrame(
+            {
+                "A": pd.to_datetime(["2020-01-02T00:00"]).as_unit("us"),
+                "B": pd.to_datetime(["2020-01-01T00:00"])
+                .tz_localize("UTC")
+                .tz_convert("US/Eastern"),
+            }
+        )
+        result = render(
+            table,
+            P(operation="subtract", col1="A", col2="B", duration_unit="hours"),
+        )
+        self.assertEqual(result["dataframe"]["A minus B"][0], 24.0)
+
+    def test_mean_min_max(self):
+        for operation, expected in [
+            ("mean", ["2020-01-01T00:00", "2020-03-01T12:00", "2020-01-01T00:00"]),
+            ("minimum", ["2019-12-31T00:00", "2020-03-01T12:00", "2020-01-01T00:00"]),
+            ("maximum", ["2020-01-02T00:00", "2020-03-01T12:00", "2020-01-01T00:00"]),
+        ]:
+            with self.subTest(operation=operation):
+                result = self._render(operation=operation, colnames=["A", "B"])
+                assert_frame_equal(
+                    result["dataframe"][:3],
+                    self.table[:3].assign(X=pd.to_datetime(expected).as_unit("ns")),
+                )
+                self.assertEqual(result["column_formats"], {})
+
+    def test_all_null_row(self):
+        table = pd.DataFrame(
+            {"A": [pd.NaT, pd.Timestamp("2020-01-01")], "B": [pd.NaT, pd.NaT]}
+        ).astype("datetime64[ns]")
+        for operation in ["mean", "minimum", "maximum"]:
+            with self.subTest(operation=operation):
+                result = render(
+                    table.copy(), P(operation=operation, colnames=["A", "B"])
+                )
+                self.assertEqual(
+                    list(result["dataframe"].iloc[:, 2]),
+                    [pd.NaT, pd.Timestamp("2020-01-01")],
+                )
+
+    def test_mean_rounds_to_nearest_nanosecond(self):
+        start = pd.Timestamp("1678-01-01")
+        table = pd.DataFrame(
+            {
+                "A": [start + pd.Timedelta(1, "ns"), pd.Timestamp("2262-04-01")],
+                "B": [start, start],
+                "C": [start, start],
+            }
+        ).astype("datetime64[ns]")
+        result = render(table, P(operation="mean", colnames=["A", "B", "C"]))
+        self.assertEqual(
+            list(result["dataframe"]["Average of A, B, C"]),
+            [start, start + (pd.Timestamp("2262-04-01") - start) / 3],
+        )
+
+    def test_null_policy(self):
+        result = self._render(
+            operation="maximum", colnames=["A", "B"], null_policy="propagate"
+        )
+        self.assertEqual(
+            list(result["dataframe"]["X"].isna()), [False, True, True, False]
+        )
+
+    def test_row_chunked(self):
+        table = pd.concat([self.table] * 1000, ignore_index=True)
+        for kwargs in [
+            dict(operation="mean", colnames=["A", "B"]),
+            dict(operation="subtract", col1="A", col2="B"),
+        ]:
+            with self.subTest(**kwargs):
+                expected = render(table.copy(), P(**kwargs))["dataframe"]
+                with patch.object(calculate, "MemoryBudget", 0):
+                    self.assertEqual(
+                        calculate.plan_execution(table, P(**kwargs)).strategy,
+                        "row_chunked",
+                    )
+                    result = render(table.copy(), P(**kwargs))["dataframe"]
+                assert_frame_equal(result, expected)
+
+    def test_operation_without_timestamps(self):
+        self.assertEqual(
+            self._render(operation="add", colnames=["A", "B"]),
+            i18n_message("badParam.timestamp.operation", {"column": "A"}),
+        )
+
+    def test_timestamps_and_numbers(self):
+        table = self.table.assign(C=1.0)
+        self.assertEqual(
+            render(table, P(operation="subtract", col1="A", col2="C")),
+            i18n_message("badParam.timestamp.mixed"),
+        )
+
+    def test_null_policy_zero(self):
+        self.assertEqual(
+            self._render(operation="mean", colnames=["A", "B"], null_policy="zero"),
+            i18n_message("badParam.timestamp.zero"),
+        )
+
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        self.table = pd.DataFrame(
+            {
+                "A": [1.0, 2.0, 3.0, 4.0],
+                "Name": ["x", "Total", "y", "Total"],
+                "Value": [5.0, 10.0, 20.0, 30.0],
+                "Region": ["y", "x", None, "z"],
+            }
+        )
+
+    def _render(self, **kwargs):
+        return render(self.table.copy(), P(colnames=["A"], outcolname="X", **kwargs))
+
+    def test_lookup(self):
+        result = self._render(
+            single_value_selector="lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_key="Total",  # first match wins
+        )
+        self.assertEqual(list(result["dataframe"]["X"]), [11.0, 12.0, 13.0, 14.0])
+
+    def test_lookup_multiply(self):
+        result = self._render(
+            operation="multiply",
+            single_value_selector="lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_key="y",
+        )
+        self.assertEqual(list(result["dataframe"]["X"]), [20.0, 40.0, 60.0, 80.0])
+
+    def test_lookup_text_value(self):
+        table = self.table.assign(Value=["5", "$1,000", "x", "y"])
+        result = render(
+            table,
+            P(
+                colnames=["A"],
+                outcolname="X",
+                single_value_selector="lookup",
+                single_value_col="Value",
+                single_value_key_col="Name",
+                single_value_key="Total",
+                parse_text_numbers=True,
+            ),
+        )
+        self.assertEqual(list(result["dataframe"]["X"]), [1001, 1002, 1003, 1004])
+
+    def test_lookup_not_found(self):
+        self.assertEqual(
+            self._render(
+                single_value_selector="lookup",
+                single_value_col="Value",
+                single_value_key_col="Name",
+                single_value_key="total",
+            ),
+            i18n_message(
+                "badParam.single_value_key.notFound",
+                {"key": "total", "column": "Name"},
+            ),
+        )
+
+    def test_lookup_missing_key_col(self):
+        self.assertEqual(
+            self._render(single_value_selector="lookup", single_value_col="Value"),
+            i18n_message("badParam.single_value_key_col.missing"),
+        )
+
+    def test_row_lookup(self):
+        result = self._render(
+            single_value_selector="row_lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_row_key_col="Region",
+        )
+        # Region "y" => 20; "x" => 5; null and "z" aren't in Name => null
+        assert_frame_equal(
+            result["dataframe"], self.table.assign(X=[21.0, 7.0, np.nan, np.nan])
+        )
+
+    def test_key_col_not_text(self):
+        self.table["Number"] = [1.0, 2.0, 3.0, 4.0]
+        for selector, key_param in [
+            ("lookup", "single_value_key_col"),
+            ("row_lookup", "single_value_key_col"),
+            ("row_lookup", "single_value_row_key_col"),
+        ]:
+            with self.subTest(selector=selector, key_param=key_param):
+                params = {
+                    "single_value_selector": selector,
+                    "single_value_col": "Value",
+                    "single_value_key_col": "Name",
+                    "single_value_key": "x",
+                    "single_value_row_key_col": "Region",
+                    key_param: "Number",
+                }
+                self.assertEqual(
+                    self._render(**params),
+                    i18n_message(
+                        "badParam.single_value_key_col.notText", {"column": "Number"}
+                    ),
+                )
+
+    def test_lookup_builds_no_arrow_keys(self):
+        index = calculate._key_index(self.table["Name"])
+        self.assertEqual(index.get_position("y"), 2)
+        self.assertIsNone(index.arrow_keys)  # only get_positions() needs them
+
+    def test_row_lookup_all_null_key_col(self):
+        for dtype in ["str", object]:
+            with self.subTest(dtype=dtype):
+                self.table["Name"] = pd.Series([None] * 4, dtype=dtype)
+                result = self._render(
+                    single_value_selector="row_lookup",
+                    single_value_col="Value",
+                    single_value_key_col="Name",
+                    single_value_row_key_col="Region",
+                )
+                self.assertEqual(result["dataframe"]["X"].isna().tolist(), [True] * 4)
+
+    def test_row_lookup_not_found_accurate_sum(self):
+        params = P(
+            colnames=["A"],
+            outcolname="X",
+            single_value_selector="row_lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_row_key_col="Region",
+        )
+        default = render(self.table.copy(), params)
+        accurate = render(self.table.copy(), {**params, "accurate_sum": True})
+        assert_frame_equal(accurate["dataframe"], default["dataframe"])
+        self.assertEqual(
+            accurate["dataframe"]["X"].fillna(-1).tolist(), [21.0, 7.0, -1, -1]
+        )
+
+    def test_row_lookup_missing_row_key_col(self):
+        self.assertEqual(
+            self._render(
+                single_value_selector="row_lookup",
+                single_value_col="Value",
+                single_value_key_col="Name",
+            ),
+            i18n_message("badParam.single_value_row_key_col.missing"),
+        )
+
+    def test_row_lookup_text_value_needs_opt_in(self):
+        table = self.table.assign(Value=["5", "10", "20", "30"])
+        params = P(
+            colnames=["A"],
+            outcolname="X",
+            single_value_selector="row_lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_row_key_col="Region",
+        )
+        self.assertEqual(
+            render(table.copy(), params),
+            i18n_message("badParam.parse_text_numbers.textColumn", {"column": "Value"}),
+        )
+        result = render(table.copy(), {**params, "parse_text_numbers": True})
+        self.assertEqual(list(result["dataframe"]["X"].fillna(-1)), [21, 7, -1, -1])
+
+    def test_row_lookup_strategies_match(self):
+        rng = np.random.default_rng(0)
+        n = 5000
+        table = pd.DataFrame(
+            {
+                "A": rng.uniform(-1, 1, n),
+                "B": np.where(rng.random(n) < 0.5, np.nan, 1.0),
+                "C": rng.uniform(-1, 1, n),
+                "D": rng.uniform(-1, 1, n),
+                "Name": [f"k{i}" for i in range(n)],
+                "Value": rng.uniform(-1, 1, n),
+                "Region": [f"k{i}" for i in rng.integers(0, 2 * n, n)],
+            }
+        )
+        params = P(
+            colnames=["A", "B", "C", "D"],
+            outcolname="X",
+            single_value_selector="row_lookup",
+            single_value_col="Value",
+            single_value_key_col="Name",
+            single_value_row_key_col="Region",
+            null_policy="propagate",
+        )
+        expected = render(table.copy(), params)["dataframe"]
+        estimates = calculate.plan_execution(table, params).estimates
+        for strategy, budget in [
+            ("row_chunked", 1),
+            ("column_streaming", estimates["column_streaming"]),
+        ]:
+            with self.subTest(strategy=strategy), patch.object(
+                calculate, "MemoryBudget", budget
+            ), patch.object(calculate, "MinChunkRows", 999):
+                self.assertEqual(
+                    calculate.plan_execution(table, params).strategy, strategy
+                )
+                assert_frame_equal(render(table.copy(), params)["dataframe"], expected)
+
+    def test_key_index_cached_per_column_version(self):
+        table = self.table.copy()
+        index = calculate._key_index(table["Name"])
+        self.assertIs(calculate._key_index(table["Name"]), index)
+        table.loc[0, "Name"] = "Total"  # a new version
+        self.assertIsNot(calculate._key_index(table["Name"]), index)
+        self.assertEqual(calculate._key_index(table["Name"]).get_position("Total"), 0)
+
+    def test_key_index_cache_forgets_old_versions(self):
+        table = pd.DataFrame({"K": ["a", "b"]})
+        calculate._key_index(table["K"])
+        key = id(table["K"].array.__arrow_array__())
+        self.assertIn(key, calculate._KeyIndexes)
+        del table
+        self.assertNotIn(key, calculate._KeyIndexes)
+
+    def test_key_index_object_dtype_not_cached(self):
+        series = pd.Series(["a", "b", None, "a"], dtype=object)
+        index = calculate._key_index(series)
+        self.assertIsNot(calculate._key_index(series), index)
+        self.assertEqual(
+            list(index.get_positions(pd.Series(["a", "b", None, "c"]))), [0, 1, -1, -1]
+        )
+        self.assertEqual(index.get_position("b"), 1)
+
+
+class DifferentialTest(unittest.TestCase):
+    def _mismatches(self, engines, **kwargs):
+        cases = differential_calculate.generate_cases(n_cases=2, n_rows=50, **kwargs)
+        return [
+            (result.case.name, result.engine, result.mismatch)
+            for result in differential_calculate.run_differential(engines, cases)
+            if result.mismatch is not None
+        ]
+
+    def test_engines_match_reference(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    self._mismatches(differential_calculate.Engines, seed=seed), []
+                )
+
+    def test_report_mismatch(self):
+        mismatches = self._mismatches(
+            {"wrong": differential_calculate.render_with_params(operation="add")}
+        )
+        self.assertIn(
+            ("subtract/none#0", "wrong"),
+            [(name, engine) for name, engine, _ in mismatches],
+        )
+        self.assertNotIn("add/none#0", [name for name, _, _ in mismatches])
+
+    def test_report_exception(self):
+        def engine(table, params, input_columns):
+            raise ZeroDivisionError()
+
+        [(_, _, mismatch), *_] = self._mismatches({"broken": engine})
+        self.assertEqual(mismatch, "raised ZeroDivisionError()")
+
+    def test_compare_nan_aware(self):
+        def compare(expected, actual, **kwargs):
+            return differential_calculate.compare_results(
+                pd.DataFrame({"A": expected}), pd.DataFrame({"A": actual}), **kwargs
+            )
+
+        self.assertIsNone(compare([np.nan, np.inf, 1.0], [np.nan, np.inf, 1.0 + 1e-12]))
+        self.assertEqual(compare([np.inf], [-np.inf]), "A[0]: inf != -inf")
+        self.assertEqual(compare([1.0, np.nan], [1.0, 0.0]), "A[1]: nan != 0.0")
+        self.assertIsNone(compare([1, 2], [1.0, 2.0]))
+        self.assertEqual(
+            compare([1, 2], [1.0, 2.0], check_dtype=True),
+            "A: dtype int64 != float64",
+        )
+
+    def test_compare_errors(self):
+        self.assertEqual(
+            differential_calculate.compare_results(
+                i18n_message("badParam.single_value_row.tooSmall"),
+                pd.DataFrame({"A": [1]}),
+            ),
+            "I18nMessage != DataFrame",
+        )
+
+
+class ExecutionPlanTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.table = pd.DataFrame(
+            {c: rng.uniform(-1, 1, 10000) for c in ["A", "B", "C", "D"]}
+        )
+        self.table.iloc[::3, 0] = np.nan
+        self.table.iloc[::4, 1] = np.nan
+
+    def _plan(self, budget, **kwargs):
+        return calculate.plan_execution(
+            self.table, P(colnames=["A", "B", "C", "D"], **kwargs), budget=budget
+        )
+
+    def test_whole_table_when_it_fits(self):
+        plan = self._plan(1 << 30, operation="add")
+        self.assertEqual(plan.strategy, "whole_table")
+        self.assertEqual(plan.estimated_bytes, plan.estimates["whole_table"])
+        self.assertIsNone(plan.chunk_rows)
+
+    def test_column_streaming(self):
+        estimates = self._plan(1 << 30, operation="add").estimates
+        self.assertLess(estimates["column_streaming"], estimates["whole_table"])
+        plan = self._plan(estimates["column_streaming"], operation="add")
+        self.assertEqual(plan.strategy, "column_streaming")
+
+    def test_median_cannot_stream(self):
+        plan = self._plan(500000, operation="median")
+        self.assertNotIn("column_streaming", plan.estimates)
+        self.assertEqual(plan.strategy, "row_chunked")
+        self.assertLessEqual(plan.estimated_bytes, 500000)
+        self.assertLess(plan.chunk_rows, len(self.table))
+
+    def test_percent_of_column_sum_cannot_chunk(self):
+        plan = self._plan(0, operation="percent_of_column_sum", col1="A")
+        self.assertEqual(list(plan.estimates.keys()), ["whole_table"])
+        self.assertEqual(plan.strategy, "whole_table")
+
+    def test_smallest_estimate_when_nothing_fits(self):
+        with patch.object(calculate, "MinChunkRows", 5000):
+            plan = self._plan(0, operation="add")
+        self.assertEqual(plan.strategy, "row_chunked")
+        self.assertEqual(plan.chunk_rows, 5000)
+        self.assertGreater(plan.estimated_bytes, 0)
+
+    def test_count_parsing_text(self):
+        text = self.table.apply(lambda column: column.map("${:,.2f}".format))
+        params = P(colnames=["A", "B", "C", "D"], parse_text_numbers=True)
+        numbers_plan = calculate.plan_execution(self.table, params, budget=0)
+        text_plan = calculate.plan_execution(text, params, budget=0)
+        for strategy, nbytes in numbers_plan.estimates.items():
+            with self.subTest(strategy=strategy):
+                # Four parsed float64 columns, plus the parsing temporaries
+                self.assertGreater(
+                    text_plan.estimates[strategy], nbytes + 4 * 8 * len(text)
+                )
+
+    def test_default_budget(self):
+        with patch.object(calculate, "MemoryBudget", 12345):
+            plan = calculate.plan_execution(self.table, P(colnames=["A", "B"]))
+        self.assertEqual(plan.budget, 12345)
+        self.assertIn("budget=12345", repr(plan))
+
+    def _render_all_strategies(self, **kwargs):
+        params = P(outcolname="X", **kwargs)
+        estimates = calculate.plan_execution(self.table, params).estimates
+        results = {}
+        for strategy, budget in [
+            ("whole_table", 1 << 30),
+            ("column_streaming", estimates.get("column_streaming")),
+            ("row_chunked", 0),
+        ]:
+            if budget is None:
+                continue
+            with patch.object(calculate, "MemoryBudget", budget), patch.object(
+                calculate, "MinChunkRows", 999
+            ):
+                self.assertEqual(
+                    calculate.plan_execution(self.table, params).strategy, strategy
+                )
+                results[strategy] = render(self.table.copy(), params)["dataframe"]
+        for strategy, result in results.items():
+            with self.subTest(strategy=strategy):
+                assert_frame_equal(result, results["whole_table"], check_dtype=False)
+        return results
+
+    def test_strategies_match(self):
+        for operation in ["add", "multiply", "mean", "minimum", "maximum"]:
+            for null_policy in ["default", "propagate", "zero", "min_count"]:
+                with self.subTest(operation=operation, null_policy=null_policy):
+                    results = self._render_all_strategies(
+                        operation=operation,
+                        colnames=["A", "B", "C", "D"],
+                        null_policy=null_policy,
+                        null_min_count=3,
+                    )
+                    self.assertEqual(len(results), 3)
+
+    def test_strategies_match_single_value(self):
+        self._render_all_strategies(
+            operation="multiply",
+            colnames=["A", "B", "D"],
+            single_value_selector="cell",
+            single_value_col="C",
+            single_value_row=5000,
+        )
+
+    def test_strategies_match_binary(self):
+        for null_policy in ["default", "zero"]:
+            with self.subTest(null_policy=null_policy):
+                self._render_all_strategies(
+                    operation="percent_change",
+                    col1="A",
+                    col2="B",
+                    null_policy=null_policy,
+                )
+
+    def test_streaming_integer_sum_stays_integer(self):
+        table = pd.DataFrame({"A": [1, 2], "B": [2 ** 62, 3]})
+        with patch.object(calculate, "MemoryBudget", 1):
+            result = render(table, P(colnames=["A", "B"], outcolname="X"))
+        self.assertEqual(list(result["dataframe"]["X"]), [2 ** 62 + 1, 5])
+
+    @unittest.skipUnless(
+        os.path.exists("/proc/self/clear_refs"), "needs Linux peak-RSS reset"
+    )
+    def test_peak_rss_under_budget(self):
+        for operation, n_rows, n_columns, budget, text, expect_strategy in [
+            ("median", 1_000_000, 8, 30_000_000, False, "row_chunked"),
+            ("add", 1_000_000, 64, 60_000_000, False, "column_streaming"),
+            ("subtract", 4_000_000, 2, 60_000_000, False, "row_chunked"),
+            ("median", 1_000_000, 4, 60_000_000, True, "row_chunked"),
+            ("add", 1_000_000, 4, 90_000_000, True, "column_streaming"),
+        ]:
+            with self.subTest(operation=operation, text=text, budget=budget):
+                strategy, peak = peak_rss(operation, n_rows, n_columns, budget, text)
+                self.assertEqual(strategy, expect_strategy)
+                self.assertLess(peak, budget)
+
 
 if __name__ == "__main__":
     unittest.main()
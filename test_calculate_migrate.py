@@ -0,0 +1,157 @@
+import io
+import json
+import subprocess
+import sys
+import unittest
+
+import calculate
+import calculate_migrate
+from test_calculate import P
+
+V0Params = {
+    "operation": 0,
+    "colnames": "A,B",
+    "col1": "",
+    "col2": "",
+    "xtext": "",
+    "single_value_selector": 0,
+    "single_value_col": "",
+    "single_value_row": 1,
+    "single_value_constant": 0.0,
+}
+
+
+def _before(params, key):
+    """Return `params` as it was before the migration that added `key`."""
+    keys = list(params)
+    return {k: params[k] for k in keys[: keys.index(key)]}
+
+
+V1Params = {
+    **_before(P(), "exact_fixed_point"),
+    "colnames": "A,B",
+    "operation": 13,
+    "single_value_selector": 2,
+}
+
+V2Params = {**V1Params, "operation": "divide", "single_value_selector": "cell"}
+
+V3Params = {**V2Params, "colnames": ["A", "B"]}
+
+V4Params = {**V3Params, "exact_fixed_point": True}
+
+V5Params = {**V4Params, "accurate_sum": True}
+
+V6Params = _before(
+    P(operation="mean", null_policy="min_count", null_min_count=2),
+    "parse_text_numbers",
+)
+
+V7Params = _before(P(operation="subtract", parse_text_numbers=True), "duration_unit")
+
+V8Params = _before(
+    P(operation="subtract", duration_unit="hours"), "single_value_key_col"
+)
+
+V9Params = P(
+    single_value_selector="lookup",
+    single_value_col="Value",
+    single_value_key_col="Name",
+    single_value_key="Total",
+)
+
+
+class ValidateParamsBatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.validators = calculate_migrate.load_param_validators()
+
+    def test_valid(self):
+        self.assertEqual(
+            calculate_migrate.validate_params_batch(
+                [
+                    calculate.migrate_params(V0Params),
+                    calculate.migrate_params(V6Params),
+                ],
+                self.validators,
+            ),
+            [],
+        )
+
+    def test_default_params_are_valid(self):
+        self.assertEqual(
+            calculate_migrate.validate_params_batch([P()], self.validators), []
+        )
+
+    def test_invalid_menu_value(self):
+        self.assertEqual(
+            calculate_migrate.validate_params_batch(
+                [P(), P(operation="modulo")], self.validators
+            ),
+            [(1, "invalid operation: 'modulo'")],
+        )
+
+    def test_invalid_types(self):
+        self.assertEqual(
+            calculate_migrate.validate_params_batch(
+                [P(colnames="A,B", null_min_count=True)], self.validators
+            ),
+            [
+                (0, "invalid colnames: 'A,B'"),
+                (0, "invalid null_min_count: True"),
+            ],
+        )
+
+    def test_missing_and_extra_keys(self):
+        params = {**P(), "xtext": ""}
+        del params["outcolname"]
+        self.assertEqual(
+            calculate_migrate.validate_params_batch([params], self.validators),
+            [(0, "missing keys ['outcolname'], unexpected keys ['xtext']")],
+        )
+
+
+class MainTest(unittest.TestCase):
+    def _run(self, params_list, *args):
+        return subprocess.run(
+            [sys.executable, calculate_migrate.__file__, *args],
+            input="".join(json.dumps(params) + "\n" for params in params_list),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    def test_jsonl(self):
+        params_list = [
+            V0Params,
+            V1Params,
+            V2Params,
+            V3Params,
+            V4Params,
+            V5Params,
+            V6Params,
+            V7Params,
+            V8Params,
+            V9Params,
+        ]
+        completed = self._run(params_list, "--batch-size", "4")
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertEqual(
+            list(io.StringIO(completed.stdout)),
+            [
+                json.dumps(calculate.migrate_params(params)) + "\n"
+                for params in params_list
+            ],
+        )
+        self.assertIn("Migrated 10 params", completed.stderr)
+        self.assertIn("1 already up to date; 0 invalid", completed.stderr)
+
+    def test_report_invalid(self):
+        completed = self._run([P(), P(operation="modulo")])
+        self.assertEqual(completed.returncode, 1)
+        self.assertIn("params 2: invalid operation: 'modulo'", completed.stderr)
+        self.assertIn("1 invalid", completed.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
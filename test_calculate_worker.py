@@ -0,0 +1,295 @@
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import calculate
+import calculate_worker
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from test_calculate import P
+
+
+def _serve(*messages, n_threads=1):
+    """Run a Worker over in-memory pipes; return responses, ordered by id."""
+    rfile = io.BytesIO()
+    for header, table in messages:
+        calculate_worker.write_message(rfile, header, table)
+    rfile.seek(0)
+    wfile = io.BytesIO()
+
+    worker = calculate_worker.Worker(n_threads=n_threads, max_queue=2)
+    worker.start()
+    try:
+        worker.serve(rfile, wfile)
+    finally:
+        worker.stop()
+
+    wfile.seek(0)
+    responses = []
+    while True:
+        message = calculate_worker.read_message(wfile)
+        if message is None:
+            break
+        responses.append(message)
+    return sorted(responses, key=lambda message: message[0]["id"])
+
+
+def _render_request(id, table, params):
+    return (
+        {
+            "id": id,
+            "method": "render",
+            "params": params,
+            "input_columns": {
+                name: {"type": "number", "format": "{:,.2f}"} for name in table.columns
+            },
+        },
+        table,
+    )
+
+
+class WorkerTest(unittest.TestCase):
+    def test_migrate_params(self):
+        [(header, table)] = _serve(
+            (
+                {
+                    "id": 1,
+                    "method": "migrate_params",
+                    "params": {**P(), "colnames": "A,B", "operation": 0},
+                },
+                None,
+            )
+        )
+        self.assertEqual(header["id"], 1)
+        self.assertEqual(header["params"], P(colnames=["A", "B"]))
+        self.assertGreaterEqual(header["elapsed_ms"], header["queue_ms"])
+        self.assertIsNone(table)
+
+    def test_render(self):
+        [(header, table)] = _serve(
+            _render_request(
+                1,
+                pd.DataFrame({"A": [1.0, 2.0], "B": [3.0, 4.0]}),
+                P(operation="add", colnames=["A", "B"]),
+            )
+        )
+        self.assertEqual(header["errors"], [])
+        self.assertEqual(header["column_formats"], {"Sum of A, B": "{:,.2f}"})
+        assert_frame_equal(
+            table,
+            pd.DataFrame({"A": [1.0, 2.0], "B": [3.0, 4.0], "Sum of A, B": [4.0, 6.0]}),
+        )
+        self.assertEqual(header["plan"]["strategy"], "whole_table")
+        self.assertEqual(header["plan"]["budget"], calculate.MemoryBudget)
+
+    def test_render_no_op(self):
+        [(header, table)] = _serve(
+            _render_request(1, pd.DataFrame({"A": [1.0]}), P(operation="add"))
+        )
+        self.assertEqual(header["errors"], [])
+        assert_frame_equal(table, pd.DataFrame({"A": [1.0]}))
+
+    def test_render_result_only(self):
+        header, table = _render_request(
+            1,
+            pd.DataFrame({"A": [1.0, 2.0], "B": [3.0, 4.0]}),
+            P(operation="add", colnames=["A", "B"]),
+        )
+        [(header, table)] = _serve(({**header, "result_only": True}, table))
+        self.assertEqual(header["errors"], [])
+        self.assertEqual(header["column_formats"], {"Sum of A, B": "{:,.2f}"})
+        assert_frame_equal(table, pd.DataFrame({"Sum of A, B": [4.0, 6.0]}))
+
+    def test_render_result_only_no_op(self):
+        header, table = _render_request(1, pd.DataFrame({"A": [1.0]}), P())
+        [(header, table)] = _serve(({**header, "result_only": True}, table))
+        self.assertEqual(header["errors"], [])
+        self.assertEqual(list(table.columns), [])
+
+    def test_render_error(self):
+        [(header, table)] = _serve(
+            _render_request(
+                1,
+                pd.DataFrame({"A": [1.0, -1.0]}),
+                P(operation="percent_of_column_sum", col1="A"),
+            )
+        )
+        self.assertEqual(
+            header["errors"],
+            [
+                {
+                    "id": "badData.percent_of_column_sum.sumIsZero",
+                    "arguments": {},
+                    "source": "module",
+                }
+            ],
+        )
+        self.assertIsNone(table)
+
+    def test_exception(self):
+        [(header, table)] = _serve(({"id": 1, "method": "fetch"}, None))
+        self.assertIn("Unknown method 'fetch'", header["exception"])
+
+    def test_unserializable_response(self):
+        def handle_request(header, table):
+            if header["id"] == 1:
+                return {}, pd.DataFrame({"A": [1, "x"]}, dtype=object)  # not Arrow
+            else:
+                return {"value": object()}, None  # not JSON
+
+        with patch.object(calculate_worker, "handle_request", handle_request):
+            responses = _serve(({"id": 1}, None), ({"id": 2}, None))
+        self.assertEqual([header["id"] for header, _ in responses], [1, 2])
+        self.assertIn("ArrowInvalid", responses[0][0]["exception"])
+        self.assertIsNone(responses[0][1])
+        self.assertIn("TypeError", responses[1][0]["exception"])
+
+    def test_many_requests_many_threads(self):
+        table = pd.DataFrame({"A": [1.0, 2.0], "B": [3.0, 4.0]})
+        responses = _serve(
+            *[
+                _render_request(
+                    i,
+                    table,
+                    P(operation="multiply", colnames=["A", "B"], outcolname="X"),
+                )
+                for i in range(20)
+            ],
+            n_threads=4,
+        )
+        self.assertEqual([header["id"] for header, _ in responses], list(range(20)))
+        for _, result in responses:
+            self.assertEqual(list(result["X"]), [3.0, 8.0])
+
+    @contextlib.contextmanager
+    def _socket_worker(self):
+        """Serve a one-thread Worker on a Unix socket; yield its path."""
+        worker = calculate_worker.Worker()
+        worker.start()
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "calculate.sock")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen()
+            thread = threading.Thread(target=worker.serve_socket, args=(server,))
+            thread.start()
+            try:
+                yield path
+            finally:
+                server.shutdown(socket.SHUT_RDWR)  # interrupt accept()
+                server.close()
+                thread.join()
+                worker.stop()
+
+    def _migrate_over_socket(self, path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(5)
+            client.connect(path)
+            with client.makefile("rb") as rfile, client.makefile("wb") as wfile:
+                calculate_worker.write_message(
+                    wfile, {"id": "x", "method": "migrate_params", "params": P()}
+                )
+                header, _ = calculate_worker.read_message(rfile)
+        return header
+
+    def test_unix_socket(self):
+        with self._socket_worker() as path:
+            header = self._migrate_over_socket(path)
+        self.assertEqual(header["params"], P())
+
+    def test_unix_socket_malformed_message(self):
+        with self._socket_worker() as path:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.settimeout(5)
+                client.connect(path)
+                with client.makefile("rb") as rfile, client.makefile("wb") as wfile:
+                    calculate_worker.write_message(
+                        wfile, {"id": 1, "method": "migrate_params", "params": P()}
+                    )
+                    wfile.write(b"not json\n")
+                    wfile.flush()
+                    responses = []
+                    while True:
+                        message = calculate_worker.read_message(rfile)
+                        if message is None:
+                            break  # the worker closed the connection
+                        responses.append(message[0])
+            # A client that hangs up before its response can't break the worker
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(path)
+                client.sendall(b"not json\n")
+            header = self._migrate_over_socket(path)
+        responses.sort(key=lambda header: header["id"] is None)
+        self.assertEqual([header["id"] for header in responses], [1, None])
+        self.assertEqual(responses[0]["params"], P())
+        self.assertIn("JSONDecodeError", responses[1]["exception"])
+        self.assertEqual(header["params"], P())
+
+    def test_unix_socket_replaces_stale_socket(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "calculate.sock")
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as dead:
+                dead.bind(path)  # and exit without unlinking, like a crash
+            process = subprocess.Popen(
+                [sys.executable, calculate_worker.__file__, "--socket", path]
+            )
+            try:
+                for _ in range(100):
+                    try:
+                        header = self._migrate_over_socket(path)
+                        break
+                    except (ConnectionRefusedError, FileNotFoundError):
+                        time.sleep(0.1)  # the worker is still starting
+                else:
+                    self.fail("worker never listened")
+            finally:
+                process.kill()
+                process.wait()
+        self.assertEqual(header["params"], P())
+
+    def test_stdin_stdout(self):
+        request = io.BytesIO()
+        calculate_worker.write_message(
+            request, {"id": 1, "method": "migrate_params", "params": P()}
+        )
+        completed = subprocess.run(
+            [sys.executable, calculate_worker.__file__],
+            input=request.getvalue(),
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        header, _ = calculate_worker.read_message(io.BytesIO(completed.stdout))
+        self.assertEqual(header["params"], P())
+
+    def test_memory_budget(self):
+        request = io.BytesIO()
+        calculate_worker.write_message(
+            request,
+            *_render_request(
+                1,
+                pd.DataFrame({"A": [1.0, 2.0], "B": [3.0, 4.0]}),
+                P(operation="add", colnames=["A", "B"]),
+            ),
+        )
+        completed = subprocess.run(
+            [sys.executable, calculate_worker.__file__, "--memory-budget", "10"],
+            input=request.getvalue(),
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        header, table = calculate_worker.read_message(io.BytesIO(completed.stdout))
+        self.assertEqual(header["plan"]["budget"], 10)
+        self.assertGreater(header["plan"]["estimated_bytes"], 10)
+        self.assertEqual(list(table["Sum of A, B"]), [4.0, 6.0])
+
+
+if __name__ == "__main__":
+    unittest.main()